@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import builtins
+import resource
+import tempfile
+import subprocess
+import contextlib
+from typing import List, Dict, Optional, Callable, Tuple
+
+
+BENCH_OUTPUT = "bench_output.txt"
+BENCH_BASELINE = "bench_baseline.json"
+# A benchmark slower than the baseline by more than this is reported as a regression
+REGRESSION_TOLERANCE = 0.20
+
+COMMANDS = {"write": "0x1", "read": "0x2", "flush": "0x0", "identify": "0x6", "directive_send": "0x19"}
+RULES = ["ABCD_0001", "WXYZ_00A2", "EFGH_0B10"]
+START_SECONDS = 1714557600  # 2024-05-01 10:00:00
+
+
+# ----- Synthetic data --------
+def format_micros(micros: int, second_text: Dict[int, str]) -> str:
+    seconds, fraction = divmod(micros, 1_000_000)
+    text = second_text.get(seconds)
+    if text is None:
+        text = second_text[seconds] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(START_SECONDS + seconds))
+    return f"{text}.{fraction:06d}"
+
+def generate_dat_file(path: str, lines: int, cqe_ratio: float = 0.98, failure_rate: float = 0.02,
+                      rule_checks: int = 2, pid: int = 1000, seed: int = 0) -> int:
+    '''
+    drive_access_tracker file of about lines lines: every cycle is one SQE,
+    its CQE (cqe_ratio of the cycles, the rest never complete) and rule_checks
+    rule check lines failing with failure_rate. Returns the lines written.
+    '''
+    rng = random.Random(seed)
+    commands = list(COMMANDS)
+    written = 0
+    micros = 0
+    cycle = pid << 20
+    second_text = {}
+    with open(path, "w") as f:
+        while written < lines:
+            cycle_id = f"{cycle:#x}"
+            rid = cycle % 4
+            command = rng.choice(commands)
+            failed = rng.random() < failure_rate
+            micros += rng.randint(1, 40)
+            f.write(f"{format_micros(micros, second_text)} {pid} {rid} {cycle_id} ==> {command}(opcode={COMMANDS[command]}, "
+                    f"nsid={rng.randint(1, 2)}, slba={rng.randint(0, 0xffff):#x})\n")
+            written += 1
+            if rng.random() < cqe_ratio:
+                micros += rng.randint(5, 60)
+                sc = "0x2" if failed else "0x0"
+                f.write(f"{format_micros(micros, second_text)} {pid} {rid} {cycle_id} {rng.uniform(0.01, 2.0):.2f} <== completion SCT=0x0 SC={sc}\n")
+                written += 1
+            for number, rule in enumerate(rng.sample(RULES, min(rule_checks, len(RULES)))):
+                micros += 1
+                result = "Fail" if failed and number == 0 else "Pass"
+                f.write(f"{format_micros(micros, second_text)} {pid} {rid} {cycle_id} === {result} #{cycle & 0xfffff} {rule} status check\n")
+                written += 1
+            cycle += 1
+    return written
+
+def generate_dat_set(directory: str, lines: int, files: int = 4, **kwargs) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for number in range(files):
+        path = os.path.join(directory, f"drive_access_tracker.{number}.{number:02d}ABCDEF.log")
+        generate_dat_file(path, lines // files, pid=1000 + number, seed=number, **kwargs)
+        paths.append(path)
+    return paths
+
+def generate_gtax_tree(root: str, jobs: int = 20, tests_per_job: int = 15, exception_rate: float = 0.2,
+                       fail_rate: float = 0.3, seed: int = 0) -> int:
+    '''
+    Fake rcv_dat_logs tree: root/<job id>/<test>/ with test_env_data.json,
+    results.log (Fail: section for fail_rate of the tests), exceptions.log for
+    exception_rate of them and the SN directory. Returns the number of tests.
+    '''
+    rng = random.Random(seed)
+    for job_id in range(50000, 50000 + jobs):
+        for test in range(tests_per_job):
+            test_path = os.path.join(root, str(job_id), str(test))
+            os.makedirs(os.path.join(test_path, "SN0001ABCD", "content_components", "coverage"))
+            with open(os.path.join(test_path, "test_env_data.json"), "w") as f:
+                json.dump({"test_name": f"test_{test}", "name": "SUT", "test_plan_id": "TP1"}, f)
+            results = ["Pass:"] + [f"{rule} passed" for rule in RULES] + ["x" * 80] * 200
+            if rng.random() < fail_rate:
+                results += ["Fail:"] + [f"{rule} failed" for rule in rng.sample(RULES, 2)] + ["Ignore:", "ABCD_0009"]
+            with open(os.path.join(test_path, "results.log"), "w") as f:
+                f.write("\n".join(results) + "\n")
+            if rng.random() < exception_rate:
+                with open(os.path.join(test_path, "exceptions.log"), "w") as f:
+                    f.write("".join(f"Traceback line {line}\n" for line in range(50)))
+    return jobs * tests_per_job
+
+@contextlib.contextmanager
+def inject_latency(root: str, seconds: float):
+    '''
+    Sleeps seconds on every open, scandir and stat under root, like the round
+    trips of the SMB mount. Only used inside the benchmark process.
+    '''
+    if not seconds:
+        yield
+        return
+    root = os.path.abspath(root)
+    originals = {"open": builtins.open, "scandir": os.scandir, "stat": os.stat}
+
+    def slow(function: Callable) -> Callable:
+        def wrapper(path, *args, **kwargs):
+            if isinstance(path, str) and os.path.abspath(path).startswith(root):
+                time.sleep(seconds)
+            return function(path, *args, **kwargs)
+        return wrapper
+
+    builtins.open, os.scandir, os.stat = (slow(function) for function in originals.values())
+    try:
+        yield
+    finally:
+        builtins.open, os.scandir, os.stat = originals["open"], originals["scandir"], originals["stat"]
+
+
+# ----- Benchmarks, every one runs in its own process for a clean peak RSS --------
+def count_lines(dat_files: List[str]) -> int:
+    lines = 0
+    for dat_file in dat_files:
+        with open(dat_file, "rb") as f:
+            lines += sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+    return lines
+
+def bench_parse(data: str, args) -> Tuple[int, str]:
+    from dat_parser import get_entries, get_drive_access_tracker_files
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    entries = get_entries(dat_files)
+    return count_lines(dat_files), f"{len(entries)} entries"
+
+def bench_parse_parallel(data: str, args) -> Tuple[int, str]:
+    from dat_parser import get_entries, get_drive_access_tracker_files
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    entries = get_entries(dat_files, jobs=args.jobs or None)
+    return count_lines(dat_files), f"{len(entries)} entries"
+
+def bench_cache_load(data: str, args) -> Tuple[int, str]:
+    '''
+    Entries from a warm DAT cache (filled before the timer by the parent).
+    '''
+    from dat_parser import get_drive_access_tracker_files
+    from dat_cache import get_cached_entries
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    entries = get_cached_entries(dat_files)
+    return count_lines(dat_files), f"{len(entries)} entries"
+
+def bench_rule_index(data: str, args) -> Tuple[int, str]:
+    '''
+    CycleIndex + failed SQE report data (params support and lift) of every failing rule.
+    '''
+    from dat_parser import get_drive_access_tracker_files
+    from dat_cache import get_cached_entries
+    from dat_index import CycleIndex
+    from dat_stats import ParamSimilarity
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    entries = get_cached_entries(dat_files)
+    cycle_index = CycleIndex(entries)
+    sqes = [cycle.sqe for cycle in cycle_index.cycles.values() if cycle.sqe]
+    fails = 0
+    for rule in cycle_index.failing_rules:
+        similarity = ParamSimilarity(cycle_index.get_failed_sqe(rule))
+        similarity.add_baseline(sqes)
+        similarity.rank()
+        fails += similarity.total_fails
+    return len(entries), f"{len(cycle_index.failing_rules)} rules, {fails} failed SQEs"
+
+def bench_rule_query(data: str, args) -> Tuple[int, str]:
+    '''
+    Pushed down query straight on the files: fails of one rule.
+    '''
+    from dat_parser import get_drive_access_tracker_files
+    from dat_query import DATQuery
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    matches = sum(1 for _ in DATQuery(rules=[RULES[0]], results=["Fail"]).run(dat_files))
+    return count_lines(dat_files), f"{matches} fails of {RULES[0]}"
+
+def bench_pairing(data: str, args) -> Tuple[int, str]:
+    '''
+    SQE -> CQE pairing and latency sketches while streaming the files.
+    '''
+    from dat_parser import SQE, CQE, LinePrescreen, get_drive_access_tracker_files, iter_entries
+    from dat_stats import collect_latencies
+    dat_files = get_drive_access_tracker_files(os.path.join(data, "dat"))
+    latencies = collect_latencies(iter_entries(dat_files, prescreen=LinePrescreen(directions=[SQE, CQE])), ["opcode"])
+    pairs = sum(stats.sketch.count for (command, param, _), stats in latencies.items() if param is None)
+    return count_lines(dat_files), f"{pairs} SQE/CQE pairs"
+
+def bench_crawl(data: str, args) -> Tuple[int, str]:
+    import io
+    import gtax_except_fail_mount_with_link as gtax
+    root = os.path.join(data, "gtax")
+    gtax.gtax_rcv_dat_logs_path = root
+    job_ids = sorted(int(job_id) for job_id in os.listdir(root))
+    with inject_latency(root, args.latency_ms / 1000), contextlib.redirect_stdout(io.StringIO()):
+        jobs = gtax.get_test_ids_by_job_id(job_ids, workers=args.crawl_workers)
+        gtax.look_for_file(jobs, workers=args.crawl_workers)
+    tests = sum(len(job.test_ids) for job in jobs)
+    failed_rule_dict = {}
+    for job in jobs:
+        job.get_all_failed_rule_ids(failed_rule_dict)
+    return tests, f"{len(failed_rule_dict)} failed rules"
+
+BENCHMARKS: Dict[str, Tuple[Callable, str]] = {
+    "parse": (bench_parse, "lines"),
+    "parse_parallel": (bench_parse_parallel, "lines"),
+    "cache_load": (bench_cache_load, "lines"),
+    "rule_index": (bench_rule_index, "entries"),
+    "rule_query": (bench_rule_query, "lines"),
+    "pairing": (bench_pairing, "lines"),
+    "crawl": (bench_crawl, "tests"),
+}
+
+
+def run_one(name: str, data: str, args) -> None:
+    '''
+    Child process: runs one benchmark and prints its result as JSON.
+    '''
+    function, unit = BENCHMARKS[name]
+    start = time.perf_counter()
+    count, info = function(data, args)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux, workers of the parallel parser count too
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({"seconds": seconds, "count": count, "unit": unit, "rate": count / seconds if seconds else 0.0,
+                      "peak_rss_mb": peak_kb / 1024, "info": info}))
+
+def run_child(name: str, data: str, args, env: Dict[str, str]) -> Optional[dict]:
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--data", data,
+               "--jobs", str(args.jobs), "--latency-ms", str(args.latency_ms), "--crawl-workers", str(args.crawl_workers)]
+    start = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, env=env)
+    end_to_end = time.perf_counter() - start
+    if process.returncode != 0:
+        print(f"{name} failed:\n{process.stderr}")
+        return None
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["end_to_end"] = end_to_end
+    return result
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> Tuple[List[str], bool]:
+    lines = []
+    regression = False
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = result["seconds"] / base["seconds"] if base["seconds"] else 0.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regression = True
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        lines.append(f"{name:<16} {base['seconds']:8.3f}s -> {result['seconds']:8.3f}s  x{ratio:5.2f}  "
+                     f"rss {base['peak_rss_mb']:7.1f} -> {result['peak_rss_mb']:7.1f} MB{flag}")
+    return lines, regression
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the DAT parser and the GTAX crawler on synthetic data")
+    parser.add_argument("benchmarks", nargs="*", default=[], help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--lines", type=int, default=1_000_000, help="DAT lines to generate across all the files")
+    parser.add_argument("--files", type=int, default=4, help="DAT files to generate")
+    parser.add_argument("--cqe-ratio", type=float, default=0.98, help="fraction of the SQEs with a CQE")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="fraction of the cycles failing a rule")
+    parser.add_argument("--gtax-jobs", type=int, default=20, help="jobs in the fake GTAX tree")
+    parser.add_argument("--tests-per-job", type=int, default=15, help="tests per job in the fake GTAX tree")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="sleep on every open/scandir/stat of the fake GTAX tree, like the SMB mount")
+    parser.add_argument("--crawl-workers", type=int, default=16, help="threads of the crawler")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="processes for parse_parallel, 0 uses every core")
+    parser.add_argument("--data", default=None, help="directory for the synthetic data, a temporary one by default")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic data")
+    parser.add_argument("--baseline", default=BENCH_BASELINE, help="baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="slowdown over the baseline reported as a regression")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_one(args.child, args.data, args)
+        return
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Exit: unknown benchmark(s) {', '.join(unknown)}")
+        return
+
+    data = args.data or tempfile.mkdtemp(prefix="dat_bench_")
+    # The benchmarks must not read or fill the user caches
+    env = dict(os.environ, DAT_CACHE_DIR=os.path.join(data, "cache"), GTAX_MANIFEST="")
+    try:
+        start = time.perf_counter()
+        if not os.path.isdir(os.path.join(data, "dat")):
+            generate_dat_set(os.path.join(data, "dat"), args.lines, args.files,
+                             cqe_ratio=args.cqe_ratio, failure_rate=args.failure_rate)
+        if "crawl" in names and not os.path.isdir(os.path.join(data, "gtax")):
+            generate_gtax_tree(os.path.join(data, "gtax"), args.gtax_jobs, args.tests_per_job)
+        print(f"Synthetic data in {data} ({time.perf_counter() - start:.1f}s)")
+        if {"cache_load", "rule_index"} & set(names):
+            # Fills the DAT cache, the cache benchmarks measure warm loads
+            run_child("cache_load", data, args, env)
+
+        results = {}
+        report = [f"{'benchmark':<16} {'seconds':>9} {'end to end':>11} {'rate':>14} {'peak RSS':>10}  info"]
+        for name in names:
+            result = run_child(name, data, args, env)
+            if result is None:
+                continue
+            results[name] = result
+            rate = f"{result['rate']:,.0f} {result['unit']}/s"
+            report.append(f"{name:<16} {result['seconds']:8.3f}s {result['end_to_end']:10.3f}s {rate:>14} "
+                          f"{result['peak_rss_mb']:7.1f} MB  {result['info']}")
+            print(report[-1])
+
+        regression = False
+        if os.path.isfile(args.baseline) and not args.save_baseline:
+            with open(args.baseline) as f:
+                comparison, regression = compare(results, json.load(f), args.tolerance)
+            report += ["", f"Compared with {args.baseline}:"] + comparison
+            print("\n".join(report[-len(comparison) - 2:]))
+        if args.save_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Baseline stored in {args.baseline}")
+
+        with open(BENCH_OUTPUT, "w") as f:
+            f.write("\n".join(report) + "\n")
+    finally:
+        if not args.keep and not args.data:
+            shutil.rmtree(data, ignore_errors=True)
+    if regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,118 +1,105 @@
-import re
 import os
-from typing import List, Dict, Optional
-from dataclasses import dataclass
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterable
 
+from dat_parser import (DATLine, SQE, CQE, LinePrescreen, get_drive_access_tracker_files, iter_entries,
+                        iter_entries_parallel, filter_direction, filter_command)
+from dat_cache import get_cached_entries, iter_cached_entries
+from dat_offsets import iter_around
+from dat_query import QUERY_HELP, parse_query
+from dat_stats import LatencyKey, LatencyStats, collect_latencies, merge_latencies
 
-OMIT_DIR = [".vscode"]
 
-SQE = "==>"
-CQE = "<=="
-
-@dataclass
-class DATLine:
-    timestamp: Optional[str] = None
-    pid: Optional[str] = None
-    rid: Optional[str] = None
-    cycle_id: Optional[str] = None
-    time_ms: Optional[str] = None
-    direction: Optional[str] = None
-    result: Optional[str] = None
-    number: Optional[str] = None
-    rule: Optional[str] = None
-    details: Optional[str] = None
-    filename: Optional[str] = None
-    # CQE
-    sc: Optional[str] = None
-    sct: Optional[str] = None
-    # SQE
-    command: Optional[str] = None
-    params: Optional[Dict[str, str]] = None
-
-    def populate_more_details(self) -> None:
-        if self.direction == SQE:
-            self.populate_SQE_attr()
-        elif self.direction == CQE:
-            self.populate_CQE_attr()
-
-    def populate_SQE_attr(self) -> None:
-        param_dict = {}
-        sqe = self.details.strip(" ")
-        match = sqe_pattern.match(sqe)
-        if match:
-            entry = match.groupdict()
-            param_matches = param_pattern.findall(entry["params"])
-            param_dict = {m[0]: m[1] for m in param_matches}
-            self.command = entry["command"]
-            self.params = param_dict
-
-    def populate_CQE_attr(self) -> None:
-        details = self.details
-        param_matches = param_pattern.findall(details)
-        param_dict = {m[0]: m[1] for m in param_matches}
-        self.sc = param_dict.get("SC", None)
-        self.sct = param_dict.get("SCT", None)
-
-
-
-dat_pattern = re.compile(
-    r'^(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+)\s+'
-    r'(?P<pid>\S+)\s+(?P<rid>\S+)\s+(?P<cycle_id>\S+)\s*'
-    r'(?P<time_ms>\d*\.\d+)?\s*'
-    r'(?P<direction>(==>|<==|===))\s*'
-    r'(?P<result>(Fail|Pass))?\s*'
-    r'(?P<number>#\d+\s+)?\s*'
-    r'(?P<rule>([A-Z0-9_]+))?'
-    r'(?P<details>.*)$'
-)
-
-sqe_pattern = re.compile(
-    r'^(?P<command>\w+)\('
-    r'(?P<params>[^)]+)\)'
-)
-
-param_pattern = re.compile(
-    r'(\w+)=(0x[0-9a-fA-F]+|\d+|\w+)'
-)
-
-
-# Function to get all drive_access_tracker* files from a directory
-def get_drive_access_tracker_files(directory):
-    try:
-        dat_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.startswith('drive_access_tracker')]
-        return dat_files
-    except FileNotFoundError:
-        print("Exit: That directory was not found")
-
-def get_entries(logfiles):
-    dat_entries = []
-    for logfile in logfiles:
-        with open(logfile) as f:
-            for line in f:
-                match = dat_pattern.match(line)
-                if match:
-                    entry = match.groupdict()
-                    entry['filename'] = os.path.basename(logfile)
-                    new_dat_line = DATLine(**entry)
-                    dat_entries.append(new_dat_line)
-    return dat_entries
+OMIT_DIR = [".vscode"]
+LATENCY_QUANTILES = (0.5, 0.99, 0.999)
 
 def parse_sqe_details(failed_sqe: List[DATLine]):
     for sqe in failed_sqe:
         sqe.populate_SQE_attr()
 
 
-def get_last_sqe(dat_entries: List[DATLine]):
+def get_last_sqe(dat_entries: Iterable[DATLine]):
     command_to_look = input("Command: ")
-    sqe_dat_entries = list(filter(lambda dat_line: dat_line.command == command_to_look, dat_entries))
-    if not sqe_dat_entries:
+    sqe_dat_entries = filter_command(dat_entries, command_to_look)
+    max_object = max(sqe_dat_entries, key=lambda obj: obj.ts_ns, default=None)
+    if not max_object:
         print("Command not found")
         return
 
-    max_object = max(sqe_dat_entries, key=lambda obj: obj.timestamp)
     print(f"Last run of command {command_to_look}")
     print(f"{max_object.timestamp} - {max_object.details}")
 
+def get_file_latencies(logfile: str, key_params: List[str], worst_k: int = 5, use_cache: bool = False) -> Dict[LatencyKey, LatencyStats]:
+    '''
+    Streams only the SQE/CQE lines of the file, or every entry of its cache file with use_cache.
+    '''
+    if use_cache:
+        dat_entries = iter_cached_entries([logfile])
+    else:
+        dat_entries = iter_entries([logfile], prescreen=LinePrescreen(directions=[SQE, CQE]))
+    return collect_latencies(dat_entries, key_params, worst_k)
+
+def get_latencies(dat_files: List[str], key_params: List[str], worst_k: int = 5, jobs: int = 1,
+                  use_cache: bool = False) -> Dict[LatencyKey, LatencyStats]:
+    '''
+    One latency table per DAT file (in a process pool if jobs != 1), merged at the end.
+    '''
+    file_latencies = partial(get_file_latencies, key_params=key_params, worst_k=worst_k, use_cache=use_cache)
+    if jobs == 1:
+        return merge_latencies(map(file_latencies, dat_files))
+    with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+        return merge_latencies(executor.map(file_latencies, dat_files))
+
+def print_latencies(latencies: Dict[LatencyKey, LatencyStats]):
+    quantile_titles = "".join(f"{f'p{q * 100:g}':>10}" for q in LATENCY_QUANTILES)
+    print(f"\n- SQE -> CQE latency (ms)")
+    print(f"{'command / param':<40}{'count':>10}{'mean':>10}{quantile_titles}{'max':>10}")
+    for key in sorted(latencies, key=lambda key: (key[0], key[1] or "", key[2] or "")):
+        command, param, value = key
+        sketch = latencies[key].sketch
+        name = command if param is None else f"  {param}={value}"
+        quantiles = "".join(f"{sketch.quantile(q):>10.3f}" for q in LATENCY_QUANTILES)
+        print(f"{name:<40}{sketch.count:>10}{sketch.mean:>10.3f}{quantiles}{sketch.max:>10.3f}")
+
+    print(f"\n- Slowest commands")
+    for command in sorted(command for command, param, _ in latencies if param is None):
+        print(f"\n{command}:")
+        for latency_ms, filename, cycle_id in latencies[(command, None, None)].get_worst():
+            print(f"{latency_ms:>10.3f} ms\t{filename}\t{cycle_id}")
+
+def print_around(dat_files: List[str], timestamp: str, seconds: float):
+    '''
+    Lines of every file up to seconds before and after timestamp, read through
+    the sparse offset index so only that part of the files is parsed.
+    '''
+    try:
+        dat_entries = iter_around(dat_files, timestamp, seconds)
+    except ValueError:
+        print(f'Exit: {timestamp} is not a "YYYY-MM-DD HH:MM:SS.ffffff" timestamp')
+        return
+    print(f"\nEntries {seconds}s around {timestamp}:")
+    count = 0
+    for dat_line in dat_entries:
+        print(dat_line.filename, dat_line)
+        count += 1
+    print(f"{count} entries")
+
+
+def print_query(dat_files: List[str], expressions: List[str]):
+    try:
+        query = parse_query(expressions)
+    except ValueError as e:
+        print(f"Exit: {e}")
+        return
+    count = 0
+    for dat_line in query.run(dat_files, ordered=True):
+        print(dat_line.filename, dat_line)
+        count += 1
+    print(f"{count} entries")
+
+
 def get_directory():
     script_directory = os.path.dirname(os.path.abspath(__file__))
 
@@ -130,21 +117,63 @@ def get_directory():
     return directory
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Look for SQE commands in the DAT files", epilog=QUERY_HELP,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="parse the DAT files in this many processes, 0 uses every core")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the DAT files again instead of using the parsed entries cache")
+    parser.add_argument("--latency", action="store_true",
+                        help="print SQE -> CQE latency per command instead of the directive_send commands")
+    parser.add_argument("--cache", action="store_true",
+                        help="with --latency, read the parsed entries cache instead of parsing only the SQE/CQE lines")
+    parser.add_argument("--by", nargs="+", default=[], metavar="PARAM",
+                        help="also split the latency by these SQE params, e.g. --by opcode nsid")
+    parser.add_argument("--worst", type=int, default=5,
+                        help="slowest cycle ids to print per command")
+    parser.add_argument("--where", nargs="+", metavar="KEY=VALUE",
+                        help="print the lines matching every filter, see below")
+    parser.add_argument("--around", metavar="TIMESTAMP",
+                        help='print every line logged around "YYYY-MM-DD HH:MM:SS.ffffff"')
+    parser.add_argument("--window", type=float, default=1.0, metavar="SECONDS",
+                        help="with --around, seconds before and after the timestamp")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     directory = get_directory()
     dat_files: List[str] = get_drive_access_tracker_files(directory)
     if not dat_files:
         return
     print(f"\n*{len(dat_files)} DAT files detected to check")
 
-    dat_entries: List[DATLine] = get_entries(dat_files)
-    sqe_dat_entries = list(filter(lambda dat_line: dat_line.direction == SQE, dat_entries))    
+    if args.where:
+        print_query(dat_files, args.where)
+        return
+
+    if args.around:
+        print_around(dat_files, args.around, args.window)
+        return
 
-    # ----- Print How many commands and which commands failed --------
-    parse_sqe_details(sqe_dat_entries)
+    if args.latency:
+        print_latencies(get_latencies(dat_files, args.by, args.worst, args.jobs, args.cache))
+        return
 
-    sqe_entries = [dat_line for dat_line in sqe_dat_entries if dat_line.command == "directive_send"]
-    sqe_entries_sorted_by_timestamp = sorted(sqe_entries, key=lambda dat_line: dat_line.timestamp)
+    # ----- Stream entries: SQE only -> command -> keep just the matches --------
+    if args.no_cache:
+        prescreen = LinePrescreen(directions=[SQE], commands=["directive_send"])
+        if args.jobs == 1:
+            dat_entries = iter_entries(dat_files, prescreen=prescreen)
+        else:
+            dat_entries = iter_entries_parallel(dat_files, args.jobs or None, prescreen)
+    elif args.jobs == 1:
+        dat_entries = iter_cached_entries(dat_files)
+    else:
+        dat_entries = get_cached_entries(dat_files, jobs=args.jobs or None)
+    sqe_dat_entries = filter_direction(dat_entries, SQE)
+    sqe_entries = filter_command(sqe_dat_entries, "directive_send")
+    sqe_entries_sorted_by_timestamp = sorted(sqe_entries, key=lambda dat_line: dat_line.ts_ns)
 
     print("Repeated values and their counts:", sqe_entries_sorted_by_timestamp)
 
@@ -0,0 +1,258 @@
+import os
+import zlib
+import heapq
+import struct
+import marshal
+import hashlib
+import itertools
+from typing import List, Dict, Optional, Iterable, Iterator
+
+from dat_parser import DATLine, iter_file_entries, parse_files_parallel
+
+
+DAT_CACHE_DIR = os.environ.get("DAT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dat_logs"))
+DAT_CACHE_MAX_BYTES = int(os.environ.get("DAT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+# Bump when DATLine or the encoding changes so old cache files are not read
+CACHE_VERSION = 3
+CACHE_SUFFIX = ".datc"
+# Entries per compressed block, reading or writing a cache file holds one block at a time
+CACHE_BLOCK_ENTRIES = 16384
+BLOCK_HEADER = struct.Struct("<I")
+CACHE_ERRORS = (OSError, ValueError, EOFError, TypeError, zlib.error)
+# Sparse offset indexes (dat_offsets.py) live in the same directory and LRU
+OFFSET_INDEX_SUFFIX = ".dati"
+
+# DATLine fields stored as columns, filename is the same for the whole file
+CACHED_FIELDS = ("ts_ns", "ts_digits", "pid", "rid", "cycle_id", "time_ms", "direction",
+                 "result", "number", "rule", "details")
+
+
+def get_cache_path(logfile: str, cache_dir: str = DAT_CACHE_DIR, suffix: str = CACHE_SUFFIX) -> Optional[str]:
+    try:
+        stat = os.stat(logfile)
+    except OSError:
+        return None
+    key = f"{CACHE_VERSION}\0{os.path.abspath(logfile)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+def encode_entries(dat_entries: List[DATLine]) -> bytes:
+    '''
+    One block of a cache file: length + zlib compressed marshal columns.
+    '''
+    columns = tuple(tuple(getattr(dat_line, field) for dat_line in dat_entries) for field in CACHED_FIELDS)
+    data = zlib.compress(marshal.dumps(columns), 1)
+    return BLOCK_HEADER.pack(len(data)) + data
+
+def decode_entries(data: bytes, filename: str) -> List[DATLine]:
+    columns = marshal.loads(zlib.decompress(data))
+    dat_entries = []
+    for row in zip(*columns):
+        dat_line = DATLine(None, *row[2:], filename=filename)
+        dat_line.ts_ns, dat_line.ts_digits = row[0], row[1]
+        dat_entries.append(dat_line)
+    return dat_entries
+
+def iter_cache_file(cache_path: str, filename: str) -> Iterator[DATLine]:
+    with open(cache_path, "rb") as f:
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if not header:
+                return
+            if len(header) != BLOCK_HEADER.size:
+                raise EOFError(f"{cache_path} is truncated")
+            (length,) = BLOCK_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) != length:
+                raise EOFError(f"{cache_path} is truncated")
+            yield from decode_entries(data, filename)
+
+def touch_cache_file(cache_path: str) -> None:
+    '''
+    mtime of the cache file is the LRU clock. Another process can evict it
+    at any time, that only costs a parse next time.
+    '''
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+def load_cached_entries(logfile: str, cache_dir: str = DAT_CACHE_DIR) -> Optional[List[DATLine]]:
+    cache_path = get_cache_path(logfile, cache_dir)
+    if not cache_path or not os.path.isfile(cache_path):
+        return None
+    try:
+        dat_entries = list(iter_cache_file(cache_path, os.path.basename(logfile)))
+    except CACHE_ERRORS:
+        # Broken or partial cache file, parse the log again
+        return None
+    touch_cache_file(cache_path)
+    return dat_entries
+
+
+class CacheWriter:
+    '''
+    Writes the entries of one file to its cache file a block at a time. The
+    blocks go to a tmp file renamed by commit(), so a cache file is always
+    complete. A write error only drops the cache file.
+    '''
+    def __init__(self, cache_path: str, cache_dir: str = DAT_CACHE_DIR) -> None:
+        self.cache_path = cache_path
+        self.cache_dir = cache_dir
+        self.tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        self.block: List[DATLine] = []
+        self.file = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.file = open(self.tmp_path, "wb")
+        except OSError as e:
+            self.fail(e)
+
+    def add(self, dat_line: DATLine) -> None:
+        if self.file is None:
+            return
+        self.block.append(dat_line)
+        if len(self.block) >= CACHE_BLOCK_ENTRIES:
+            self.flush()
+
+    def flush(self) -> None:
+        try:
+            self.file.write(encode_entries(self.block))
+        except OSError as e:
+            self.fail(e)
+        self.block = []
+
+    def commit(self) -> None:
+        if self.file is not None and self.block:
+            self.flush()
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+            os.replace(self.tmp_path, self.cache_path)
+        except OSError as e:
+            self.fail(e)
+            return
+        self.file = None
+        try:
+            evict_cache(self.cache_dir)
+        except OSError as e:
+            # The cache file is written, only the cleanup of the old ones failed
+            print(f"Unable to evict DAT cache files from {self.cache_dir}: {e}")
+
+    def abort(self) -> None:
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+    def fail(self, error: OSError) -> None:
+        print(f"Unable to write DAT cache {self.cache_path}: {error}")
+        self.abort()
+
+
+def store_cached_entries(logfile: str, dat_entries: Iterable[DATLine], cache_dir: str = DAT_CACHE_DIR) -> None:
+    cache_path = get_cache_path(logfile, cache_dir)
+    if not cache_path:
+        return
+    writer = CacheWriter(cache_path, cache_dir)
+    for dat_line in dat_entries:
+        writer.add(dat_line)
+    writer.commit()
+
+def evict_cache(cache_dir: str = DAT_CACHE_DIR, max_bytes: int = DAT_CACHE_MAX_BYTES) -> None:
+    '''
+    Removes the least recently used cache files until the cache fits in max_bytes.
+    '''
+    cache_files = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith((CACHE_SUFFIX, OFFSET_INDEX_SUFFIX)) and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Removed by another process since the listing
+                    continue
+                cache_files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in cache_files)
+    for _, size, path in sorted(cache_files):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+def get_cached_entries_by_file(logfiles: Iterable[str], jobs: int = 1,
+                               cache_dir: str = DAT_CACHE_DIR) -> Dict[str, List[DATLine]]:
+    '''
+    Entries of every file, from the cache when the file size and mtime did not
+    change, only the missing or changed files are parsed (in parallel if jobs != 1).
+    '''
+    entries_by_file: Dict[str, Optional[List[DATLine]]] = {}
+    for logfile in logfiles:
+        entries_by_file[logfile] = load_cached_entries(logfile, cache_dir)
+
+    to_parse = [logfile for logfile, dat_entries in entries_by_file.items() if dat_entries is None]
+    if to_parse:
+        if jobs != 1:
+            parsed = parse_files_parallel(to_parse, jobs)
+        else:
+            parsed = {logfile: list(iter_file_entries(logfile)) for logfile in to_parse}
+        for logfile in to_parse:
+            dat_entries = parsed.get(logfile, [])
+            entries_by_file[logfile] = dat_entries
+            store_cached_entries(logfile, dat_entries, cache_dir)
+    return entries_by_file
+
+def get_cached_entries(logfiles: Iterable[str], jobs: int = 1, cache_dir: str = DAT_CACHE_DIR) -> List[DATLine]:
+    entries_by_file = get_cached_entries_by_file(logfiles, jobs, cache_dir)
+    # Same timestamp ordered result as get_entries(), whatever jobs is
+    return list(heapq.merge(*entries_by_file.values(), key=lambda dat_line: dat_line.ts_ns))
+
+def iter_file_cached_entries(logfile: str, cache_dir: str = DAT_CACHE_DIR) -> Iterator[DATLine]:
+    '''
+    Entries of one file read from its cache file, or parsed and written to the
+    cache while they are yielded. Only one block is held in memory either way.
+    '''
+    cache_path = get_cache_path(logfile, cache_dir)
+    if cache_path and os.path.isfile(cache_path):
+        yielded = 0
+        try:
+            for dat_line in iter_cache_file(cache_path, os.path.basename(logfile)):
+                yield dat_line
+                yielded += 1
+        except CACHE_ERRORS:
+            # Broken cache file, the log is parsed again from the first entry not yielded yet
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+            yield from itertools.islice(iter_file_entries(logfile), yielded, None)
+            return
+        touch_cache_file(cache_path)
+        return
+
+    if not cache_path:
+        yield from iter_file_entries(logfile)
+        return
+    writer = CacheWriter(cache_path, cache_dir)
+    try:
+        for dat_line in iter_file_entries(logfile):
+            writer.add(dat_line)
+            yield dat_line
+        writer.commit()
+    finally:
+        # The caller stopped early, the cache file would be incomplete
+        writer.abort()
+
+def iter_cached_entries(logfiles: Iterable[str], cache_dir: str = DAT_CACHE_DIR) -> Iterator[DATLine]:
+    '''
+    Streaming version, entries go through one cache block at a time.
+    '''
+    for logfile in logfiles:
+        yield from iter_file_cached_entries(logfile, cache_dir)
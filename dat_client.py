@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import socket
+import argparse
+
+
+DAT_SERVER_SOCKET = os.environ.get("DAT_SERVER_SOCKET", os.path.join(os.path.expanduser("~"), ".cache", "dat_server.sock"))
+QUERY_HELP = '''queries (answered by dat_server.py from memory):
+  rule DIR [RULE ...]       failed SQEs, attributes and previous commands (every failing rule by default)
+  failing DIR               failing rules and how many fails
+  last DIR [COMMAND ...]    last SQE of every command and its status
+  context DIR CYCLE_ID [N]  the SQE of a cycle, the N commands before it, its CQE and rule checks
+  where DIR KEY=VALUE ...   lines matching the filters, same syntax as check_for_commands.py --where
+  status                    loaded DAT sets and memory
+  stop                      stop the server'''
+
+
+def send_request(request: dict, socket_path: str = DAT_SERVER_SOCKET) -> str:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())["output"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ask dat_server.py about DAT directories", epilog=QUERY_HELP,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=DAT_SERVER_SOCKET, help="Unix socket of the server")
+    parser.add_argument("command", help="query to run, see below")
+    parser.add_argument("directory", nargs="?", help="DAT directory")
+    parser.add_argument("args", nargs="*", help="arguments of the query")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    request = {"command": args.command, "args": args.args}
+    if args.directory:
+        # The server runs somewhere else, paths have to be absolute
+        request["directory"] = os.path.abspath(args.directory)
+    elif args.command not in ("status", "stop"):
+        print(f"Exit: {args.command} needs a DAT directory")
+        return
+    try:
+        print(send_request(request, args.socket), end="")
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No server on {args.socket}, start it with: python3 dat_server.py &")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+from typing import List, Dict, Optional, Iterable, Tuple
+
+from dat_parser import DATLine, SQE, CQE, NS_PER_SECOND, iter_file_entries
+
+
+# Rows sent to sqlite per executemany, memory only holds one batch
+EXPORT_BATCH_SIZE = 50000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY, file_id INTEGER, ts_ns INTEGER, timestamp TEXT, pid TEXT, rid TEXT,
+    cycle_id TEXT, time_ms REAL, direction TEXT, result TEXT, number TEXT, rule TEXT,
+    command TEXT, sc INTEGER, sct INTEGER, details TEXT);
+CREATE TABLE IF NOT EXISTS params (
+    entry_id INTEGER, param TEXT, value TEXT);
+CREATE TABLE IF NOT EXISTS cycles (
+    file_id INTEGER, cycle_id TEXT, sqe_id INTEGER, cqe_id INTEGER, command TEXT, latency_ms REAL);
+CREATE VIEW IF NOT EXISTS dat_lines AS
+    SELECT entries.*, files.path FROM entries JOIN files ON files.id = entries.file_id;
+'''
+
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS entries_cycle_id ON entries (cycle_id);
+CREATE INDEX IF NOT EXISTS entries_command ON entries (command);
+CREATE INDEX IF NOT EXISTS entries_rule ON entries (rule, result);
+CREATE INDEX IF NOT EXISTS entries_ts_ns ON entries (ts_ns);
+CREATE INDEX IF NOT EXISTS entries_file_id ON entries (file_id);
+CREATE INDEX IF NOT EXISTS params_entry_id ON params (entry_id);
+CREATE INDEX IF NOT EXISTS params_param ON params (param, value);
+CREATE INDEX IF NOT EXISTS cycles_cycle_id ON cycles (cycle_id);
+CREATE INDEX IF NOT EXISTS cycles_command ON cycles (command);
+'''
+
+
+class DATExporter:
+    '''
+    Streams the DAT entries of many files into a SQLite database: one row per
+    line, one row per SQE param and one row per SQE/CQE pair (cycles).
+    Rows go out in batches of EXPORT_BATCH_SIZE and the SQEs waiting for their
+    CQE are dropped at the end of every file, so memory does not grow with
+    the number of lines. Files already exported with the same size and mtime
+    are skipped, changed files are replaced. Every file is one transaction,
+    its files row is written with its last rows, a file interrupted in the
+    middle is not in the database and is exported again by the next run.
+    '''
+    def __init__(self, db_path: str, batch_size: int = EXPORT_BATCH_SIZE) -> None:
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(SCHEMA)
+        # Bulk load settings, the export can be run again if the machine dies
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA journal_mode = MEMORY")
+        self.next_entry_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM entries").fetchone()[0]
+        self.next_file_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM files").fetchone()[0]
+        self.entry_rows: List[Tuple] = []
+        self.param_rows: List[Tuple] = []
+        self.cycle_rows: List[Tuple] = []
+
+    def get_file_id(self, path: str, stat: os.stat_result) -> Optional[int]:
+        '''
+        file id to export path with, None when it is already exported.
+        The files row is only written by save_file() once the rows are in.
+        '''
+        row = self.connection.execute("SELECT id, size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+        if row:
+            file_id, size, mtime_ns = row
+            if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                return None
+            self.delete_file(file_id)
+            return file_id
+        file_id = self.next_file_id
+        self.next_file_id += 1
+        return file_id
+
+    def save_file(self, file_id: int, path: str, stat: os.stat_result) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO files (id, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                                (file_id, path, stat.st_size, stat.st_mtime_ns))
+
+    def delete_file(self, file_id: int) -> None:
+        self.connection.execute("DELETE FROM params WHERE entry_id IN (SELECT id FROM entries WHERE file_id = ?)",
+                                (file_id,))
+        self.connection.execute("DELETE FROM cycles WHERE file_id = ?", (file_id,))
+        self.connection.execute("DELETE FROM entries WHERE file_id = ?", (file_id,))
+
+    def export_file(self, logfile: str) -> int:
+        path = os.path.abspath(logfile)
+        # Size and mtime before reading, a file still growing is exported again next time
+        stat = os.stat(logfile)
+        file_id = self.get_file_id(path, stat)
+        if file_id is None:
+            print(f"{os.path.basename(logfile)}: already exported")
+            return 0
+        # cycle_id -> (entry id, SQE) of the SQEs waiting for their CQE in this file
+        waiting_cqe: Dict[str, Tuple[int, DATLine]] = {}
+        count = 0
+        for dat_line in iter_file_entries(logfile):
+            entry_id = self.add_entry(file_id, dat_line)
+            count += 1
+            if dat_line.direction == SQE:
+                waiting_cqe[dat_line.cycle_id] = (entry_id, dat_line)
+            elif dat_line.direction == CQE:
+                sqe_id, sqe = waiting_cqe.pop(dat_line.cycle_id, (None, None))
+                if sqe is None:
+                    continue
+                if dat_line.time_ms is not None:
+                    latency_ms = dat_line.time_ms
+                else:
+                    latency_ms = (dat_line.ts_ns - sqe.ts_ns) * 1000 / NS_PER_SECOND
+                self.cycle_rows.append((file_id, sqe.cycle_id, sqe_id, entry_id, sqe.command, latency_ms))
+        # SQEs that never got a CQE (aborted run) are still a cycle
+        for sqe_id, sqe in waiting_cqe.values():
+            self.cycle_rows.append((file_id, sqe.cycle_id, sqe_id, None, sqe.command, None))
+        self.flush()
+        self.save_file(file_id, path, stat)
+        self.connection.commit()
+        return count
+
+    def add_entry(self, file_id: int, dat_line: DATLine) -> int:
+        entry_id = self.next_entry_id
+        self.next_entry_id += 1
+        self.entry_rows.append((entry_id, file_id, dat_line.ts_ns, dat_line.timestamp, dat_line.pid, dat_line.rid,
+                                dat_line.cycle_id, dat_line.time_ms, dat_line.direction, dat_line.result,
+                                dat_line.number, dat_line.rule, dat_line.command, dat_line.sc_code,
+                                dat_line.sct_code, dat_line.details))
+        if dat_line.params:
+            self.param_rows.extend((entry_id, param, value) for param, value in dat_line.params.items())
+        if len(self.entry_rows) >= self.batch_size:
+            self.flush()
+        return entry_id
+
+    def flush(self) -> None:
+        if self.entry_rows:
+            self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        self.entry_rows)
+        if self.param_rows:
+            self.connection.executemany("INSERT INTO params VALUES (?, ?, ?)", self.param_rows)
+        if self.cycle_rows:
+            self.connection.executemany("INSERT INTO cycles VALUES (?, ?, ?, ?, ?, ?)", self.cycle_rows)
+        self.entry_rows, self.param_rows, self.cycle_rows = [], [], []
+
+    def rollback(self) -> None:
+        '''
+        Drops the rows of the file being exported, the files already committed stay.
+        '''
+        self.entry_rows, self.param_rows, self.cycle_rows = [], [], []
+        self.connection.rollback()
+        self.connection.close()
+
+    def close(self) -> None:
+        self.flush()
+        # Building the indexes once after the load is faster than keeping them updated on every insert
+        self.connection.executescript(INDEXES)
+        self.connection.commit()
+        self.connection.close()
+
+
+def export_entries(logfiles: Iterable[str], db_path: str) -> int:
+    exporter = DATExporter(db_path)
+    total = 0
+    try:
+        for logfile in logfiles:
+            count = exporter.export_file(logfile)
+            if count:
+                print(f"{os.path.basename(logfile)}: {count} entries exported")
+            total += count
+    except BaseException:
+        # Error or Ctrl+C in the middle of a file
+        exporter.rollback()
+        raise
+    exporter.close()
+    return total
@@ -0,0 +1,112 @@
+import os
+import heapq
+from collections import Counter
+from typing import List, Dict, Optional
+
+from dat_parser import (DATLine, SQE, CQE, get_drive_access_tracker_files, get_compression, iter_file_entries,
+                        scan_buffer, get_cycle_key)
+from dat_index import CycleIndex, SQETimeline
+from dat_stats import ParamSimilarity, add_sqe_pairs
+
+# Bytes read at once, the first poll of a long test can find GBs already written
+FOLLOW_READ_SIZE = int(os.environ.get("DAT_FOLLOW_READ_SIZE", 16 * 1024 * 1024))
+
+
+class DATFollower:
+    '''
+    Keeps reading the DAT files of a directory while the test is running.
+    Every poll() only parses the bytes appended since the previous one,
+    a partial last line is kept until its newline shows up.
+    '''
+    def __init__(self, directory: str, context_by: Optional[str] = None) -> None:
+        self.directory = directory
+        self.offsets: Dict[str, int] = {}
+        self.partial_lines: Dict[str, bytes] = {}
+        self.cycle_index = CycleIndex()
+        self.sqe_timeline = SQETimeline(group_by=context_by)
+        self.fail_counts: Counter = Counter()
+        # count_sqe_pairs() of every SQE and of the failed SQEs per rule, kept up to date
+        # so get_param_similarity() does not go through every cycle on each new failure
+        self.sqe_counts: Dict[str, Counter] = {}
+        self.failed_counts: Dict[str, Dict[str, Counter]] = {}
+
+    def poll(self) -> List[DATLine]:
+        entries_by_file = [self.read_new_entries(logfile)
+                           for logfile in get_drive_access_tracker_files(self.directory) or []]
+        # Same order as get_entries(), the failures are kept in the order they were logged
+        new_entries = list(heapq.merge(*entries_by_file, key=lambda dat_line: dat_line.ts_ns))
+        for dat_line in new_entries:
+            self.add(dat_line)
+        self.sqe_timeline.extend(new_entries)
+        return new_entries
+
+    def add(self, dat_line: DATLine) -> None:
+        key = get_cycle_key(dat_line)
+        if dat_line.direction == SQE:
+            if self.cycle_index.get_sqe(key) is None:
+                # First SQE of the cycle, the one CycleIndex keeps
+                add_sqe_pairs(self.sqe_counts, dat_line)
+                cycle = self.cycle_index.cycles.get(key)
+                failed_rules = {rule_check.rule for rule_check in cycle.rule_checks
+                                if rule_check.result == "Fail"} if cycle else ()
+                for rule in failed_rules:
+                    add_sqe_pairs(self.failed_counts.setdefault(rule, {}), dat_line)
+        elif dat_line.direction != CQE and dat_line.rule and dat_line.result == "Fail":
+            sqe = self.cycle_index.get_sqe(key)
+            if sqe is not None and key not in self.cycle_index.failed_cycle_ids.get(dat_line.rule, {}):
+                add_sqe_pairs(self.failed_counts.setdefault(dat_line.rule, {}), sqe)
+        if dat_line.result == "Fail":
+            self.fail_counts[dat_line.rule] += 1
+        self.cycle_index.add(dat_line)
+
+    def get_param_similarity(self, rule: str) -> ParamSimilarity:
+        '''
+        Same as parse_dat_files_class.get_param_similarity() over every entry
+        read so far, from the counters instead of the cycles.
+        '''
+        failed_counts = self.failed_counts.get(rule, {})
+        similarity = ParamSimilarity(())
+        similarity.add_failure_counts(failed_counts)
+        similarity.add_baseline_counts(self.sqe_counts, failed_counts)
+        return similarity
+
+    def read_new_entries(self, logfile: str) -> List[DATLine]:
+        try:
+            size = os.path.getsize(logfile)
+        except FileNotFoundError:
+            return []
+        offset = self.offsets.get(logfile)
+
+        # Compressed files do not grow, they are read once
+        if get_compression(logfile):
+            if offset is not None:
+                return []
+            self.offsets[logfile] = size
+            return list(iter_file_entries(logfile))
+
+        offset = offset or 0
+        if size < offset:
+            # File truncated or rewritten, start again
+            offset = 0
+            self.partial_lines.pop(logfile, None)
+        if size == offset:
+            return []
+
+        new_entries = []
+        filename = os.path.basename(logfile)
+        data = self.partial_lines.pop(logfile, b'')
+        with open(logfile, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                chunk = f.read(min(FOLLOW_READ_SIZE, size - offset))
+                if not chunk:
+                    break
+                offset += len(chunk)
+                data += chunk
+                complete = data.rfind(b'\n') + 1
+                new_entries.extend(scan_buffer(data, filename, 0, complete))
+                data = data[complete:]
+        self.offsets[logfile] = offset
+        if data:
+            self.partial_lines[logfile] = data
+        return new_entries
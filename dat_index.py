@@ -0,0 +1,153 @@
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Optional, Iterable
+from dataclasses import dataclass, field
+
+from dat_parser import DATLine, SQE, CQE, CycleKey, get_cycle_key
+
+
+@dataclass
+class Cycle:
+    sqe: Optional[DATLine] = None
+    cqe: Optional[DATLine] = None
+    rule_checks: List[DATLine] = field(default_factory=list)
+
+
+class CycleIndex:
+    '''
+    Built once after loading the entries:
+    (filename, cycle_id) -> SQE, CQE and rule check lines, and rule -> failed
+    (filename, cycle_id). Cycle ids repeat across the files of a session.
+    '''
+    def __init__(self, dat_entries: Iterable[DATLine] = ()) -> None:
+        self.cycles: Dict[CycleKey, Cycle] = {}
+        # Dict used as an ordered set, keeps the order the failures were logged
+        self.failed_cycle_ids: Dict[str, Dict[CycleKey, None]] = {}
+        for dat_line in dat_entries:
+            self.add(dat_line)
+
+    def add(self, dat_line: DATLine) -> None:
+        key = get_cycle_key(dat_line)
+        cycle = self.cycles.get(key)
+        if cycle is None:
+            cycle = self.cycles[key] = Cycle()
+
+        if dat_line.direction == SQE:
+            if cycle.sqe is None:
+                cycle.sqe = dat_line
+        elif dat_line.direction == CQE:
+            if cycle.cqe is None:
+                cycle.cqe = dat_line
+        elif dat_line.rule:
+            cycle.rule_checks.append(dat_line)
+            if dat_line.result == "Fail":
+                self.failed_cycle_ids.setdefault(dat_line.rule, {})[key] = None
+
+    def get_sqe(self, key: CycleKey) -> Optional[DATLine]:
+        cycle = self.cycles.get(key)
+        return cycle.sqe if cycle else None
+
+    def get_cqe(self, key: CycleKey) -> Optional[DATLine]:
+        cycle = self.cycles.get(key)
+        return cycle.cqe if cycle else None
+
+    def find_cycle_id(self, cycle_id: str) -> List[CycleKey]:
+        '''
+        Every (filename, cycle_id) with that cycle id, one per file at most.
+        '''
+        return [key for key in self.cycles if key[1] == cycle_id]
+
+    def get_failed_cycle_ids(self, rule: str) -> List[CycleKey]:
+        return list(self.failed_cycle_ids.get(rule, {}))
+
+    def get_failed_sqe(self, rule: str, how_many_sqe: Optional[int] = None) -> List[DATLine]:
+        failed_sqe = []
+        for key in self.failed_cycle_ids.get(rule, {}):
+            sqe = self.get_sqe(key)
+            if sqe is None:
+                continue
+            failed_sqe.append(sqe)
+            if how_many_sqe and len(failed_sqe) == how_many_sqe:
+                break
+        return failed_sqe
+
+    @property
+    def failing_rules(self) -> List[str]:
+        return list(self.failed_cycle_ids)
+
+
+class SQETimeline:
+    '''
+    SQEs sorted once by timestamp, optionally one timeline per file or per pid
+    (group_by="filename" / "pid"), so the commands sent before a given SQE
+    are found with a binary search instead of filtering and sorting every entry.
+    '''
+    def __init__(self, dat_entries: Iterable[DATLine] = (), group_by: Optional[str] = None) -> None:
+        self.group_by = group_by
+        sqes_by_group: Dict[Optional[str], List[DATLine]] = {}
+        for dat_line in dat_entries:
+            if dat_line.direction == SQE:
+                sqes_by_group.setdefault(self._group(dat_line), []).append(dat_line)
+
+        self.sqes: Dict[Optional[str], List[DATLine]] = {}
+        self.timestamps: Dict[Optional[str], List[int]] = {}
+        for group, sqes in sqes_by_group.items():
+            sqes.sort(key=lambda dat_line: dat_line.ts_ns)
+            self.sqes[group] = sqes
+            self.timestamps[group] = [dat_line.ts_ns for dat_line in sqes]
+
+    def add(self, dat_line: DATLine) -> None:
+        '''
+        Adds one SQE, used when entries keep arriving (follow mode).
+        '''
+        if dat_line.direction != SQE:
+            return
+        group = self._group(dat_line)
+        sqes = self.sqes.setdefault(group, [])
+        timestamps = self.timestamps.setdefault(group, [])
+        if not timestamps or dat_line.ts_ns >= timestamps[-1]:
+            sqes.append(dat_line)
+            timestamps.append(dat_line.ts_ns)
+            return
+        position = bisect_right(timestamps, dat_line.ts_ns)
+        sqes.insert(position, dat_line)
+        timestamps.insert(position, dat_line.ts_ns)
+
+    def extend(self, dat_entries: Iterable[DATLine]) -> None:
+        '''
+        Adds the SQEs of a batch (one poll of follow mode) at once: appended
+        when they are newer than the timeline, otherwise the group is sorted
+        again, which is linear for the two sorted runs instead of one insert
+        per late SQE.
+        '''
+        new_sqes: Dict[Optional[str], List[DATLine]] = {}
+        for dat_line in dat_entries:
+            if dat_line.direction == SQE:
+                new_sqes.setdefault(self._group(dat_line), []).append(dat_line)
+        for group, batch in new_sqes.items():
+            batch.sort(key=lambda dat_line: dat_line.ts_ns)
+            sqes = self.sqes.setdefault(group, [])
+            timestamps = self.timestamps.setdefault(group, [])
+            sqes.extend(batch)
+            if timestamps and batch[0].ts_ns < timestamps[-1]:
+                # Stable, the SQEs already there stay before the new ones with the same timestamp
+                sqes.sort(key=lambda dat_line: dat_line.ts_ns)
+                timestamps[:] = [dat_line.ts_ns for dat_line in sqes]
+            else:
+                timestamps.extend(dat_line.ts_ns for dat_line in batch)
+
+    def _group(self, dat_line: DATLine) -> Optional[str]:
+        if self.group_by is None:
+            return None
+        return getattr(dat_line, self.group_by)
+
+    def get_previous(self, dat_line: DATLine, how_many: int = 1) -> List[DATLine]:
+        '''
+        Up to how_many SQEs logged strictly before dat_line, newest first.
+        '''
+        group = self._group(dat_line)
+        timestamps = self.timestamps.get(group)
+        if not timestamps:
+            return []
+        position = bisect_left(timestamps, dat_line.ts_ns)
+        start = max(position - how_many, 0)
+        return self.sqes[group][start:position][::-1]
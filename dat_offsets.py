@@ -0,0 +1,148 @@
+import os
+import re
+import mmap
+import zlib
+import heapq
+import marshal
+import itertools
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Iterable, Iterator, Tuple
+
+from dat_parser import (DATLine, LinePrescreen, NS_PER_SECOND, get_compression, iter_file_entries_text,
+                        parse_timestamp, scan_buffer)
+from dat_cache import DAT_CACHE_DIR, OFFSET_INDEX_SUFFIX, get_cache_path, evict_cache
+
+
+# One checkpoint (byte offset, timestamp) every this many lines
+OFFSET_INDEX_STEP = 1024
+
+timestamp_pattern_bytes = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+')
+
+
+class OffsetIndex:
+    '''
+    Sparse index of one plain DAT file: the byte offset and timestamp of
+    every OFFSET_INDEX_STEP-th line. DAT files are chronological, so the
+    lines of a time range are between two checkpoints found with bisect.
+    '''
+    def __init__(self, offsets: List[int], timestamps: List[int], file_size: int) -> None:
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.file_size = file_size
+
+    @classmethod
+    def build(cls, buffer, step: int = OFFSET_INDEX_STEP) -> "OffsetIndex":
+        offsets, timestamps = [], []
+        file_size = len(buffer)
+        position = 0
+        line_count = 0
+        while position < file_size:
+            newline = buffer.find(b"\n", position)
+            next_line = file_size if newline == -1 else newline + 1
+            # A line without timestamp can not be a checkpoint, the next one is used
+            if line_count >= 0:
+                match = timestamp_pattern_bytes.match(buffer, position, next_line)
+                if match:
+                    offsets.append(position)
+                    timestamps.append(parse_timestamp(match.group().decode())[0])
+                    line_count = -step
+            line_count += 1
+            position = next_line
+        return cls(offsets, timestamps, file_size)
+
+    def get_range(self, start_ns: Optional[int] = None, end_ns: Optional[int] = None) -> Tuple[int, int]:
+        '''
+        Byte range holding every line with start_ns <= timestamp <= end_ns.
+        '''
+        start, end = 0, self.file_size
+        if start_ns is not None:
+            # Last checkpoint before start_ns, lines with the same timestamp may come before a checkpoint
+            position = bisect_left(self.timestamps, start_ns) - 1
+            if position > 0:
+                start = self.offsets[position]
+        if end_ns is not None:
+            position = bisect_right(self.timestamps, end_ns)
+            if position < len(self.offsets):
+                end = self.offsets[position]
+        return start, end
+
+    def encode(self) -> bytes:
+        return zlib.compress(marshal.dumps((self.offsets, self.timestamps, self.file_size)), 1)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "OffsetIndex":
+        return cls(*marshal.loads(zlib.decompress(data)))
+
+
+def load_offset_index(logfile: str, buffer, cache_dir: str = DAT_CACHE_DIR) -> OffsetIndex:
+    '''
+    Offset index of the file from the cache directory, the key has the size and
+    mtime of the file so it is built again as soon as the file changes.
+    '''
+    index_path = get_cache_path(logfile, cache_dir, OFFSET_INDEX_SUFFIX)
+    if index_path and os.path.isfile(index_path):
+        try:
+            with open(index_path, "rb") as f:
+                offset_index = OffsetIndex.decode(f.read())
+            if offset_index.file_size == len(buffer):
+                os.utime(index_path)
+                return offset_index
+        except (OSError, ValueError, EOFError, TypeError, zlib.error):
+            pass
+
+    offset_index = OffsetIndex.build(buffer)
+    if index_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(offset_index.encode())
+            os.replace(tmp_path, index_path)
+            evict_cache(cache_dir)
+        except OSError as e:
+            print(f"Unable to write DAT offset index {index_path}: {e}")
+    return offset_index
+
+def in_time_range(dat_entries: Iterable[DATLine], start_ns: Optional[int], end_ns: Optional[int]) -> Iterator[DATLine]:
+    for dat_line in dat_entries:
+        if start_ns is not None and dat_line.ts_ns < start_ns:
+            continue
+        if end_ns is not None and dat_line.ts_ns > end_ns:
+            break
+        yield dat_line
+
+def iter_file_time_range(logfile: str, start_ns: Optional[int] = None, end_ns: Optional[int] = None,
+                         prescreen: Optional[LinePrescreen] = None,
+                         cache_dir: str = DAT_CACHE_DIR) -> Iterator[DATLine]:
+    '''
+    Entries of one file with start_ns <= timestamp <= end_ns, only the lines
+    between the two nearest checkpoints are parsed.
+    Compressed files can not seek, they are streamed until end_ns instead.
+    '''
+    if get_compression(logfile):
+        yield from in_time_range(iter_file_entries_text(logfile, prescreen), start_ns, end_ns)
+        return
+    filename = os.path.basename(logfile)
+    with open(logfile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start, end = load_offset_index(logfile, buffer, cache_dir).get_range(start_ns, end_ns)
+            yield from in_time_range(scan_buffer(buffer, filename, start, end, prescreen), start_ns, end_ns)
+
+def iter_time_range(logfiles: Iterable[str], start_ns: Optional[int] = None, end_ns: Optional[int] = None,
+                    prescreen: Optional[LinePrescreen] = None, ordered: bool = True) -> Iterator[DATLine]:
+    streams = [iter_file_time_range(logfile, start_ns, end_ns, prescreen) for logfile in logfiles]
+    if ordered:
+        return heapq.merge(*streams, key=lambda dat_line: dat_line.ts_ns)
+    return itertools.chain.from_iterable(streams)
+
+def iter_around(logfiles: Iterable[str], timestamp: str, seconds: float = 1.0,
+                prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    '''
+    Entries of every file logged up to seconds before or after timestamp
+    ("2024-05-01 10:00:00.123456"), merged by timestamp.
+    '''
+    ts_ns = parse_timestamp(timestamp)[0]
+    window_ns = int(seconds * NS_PER_SECOND)
+    return iter_time_range(logfiles, ts_ns - window_ns, ts_ns + window_ns, prescreen)
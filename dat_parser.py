@@ -0,0 +1,546 @@
+import re
+import io
+import os
+import gzip
+import lzma
+import mmap
+import sys
+import time
+import calendar
+import heapq
+import itertools
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterable, Iterator, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DAT_PREFIX = 'drive_access_tracker'
+# Read plain DAT files through mmap + bytes regex instead of text mode
+USE_MMAP = True
+# drive_access_tracker.*.log and *.log.aborted files can also come compressed
+COMPRESSED_SUFFIXES = ('.gz', '.xz', '.zst')
+# Files bigger than this are split in byte ranges between the parallel workers
+PARALLEL_CHUNK_SIZE = 32 * 1024 * 1024
+
+SQE = "==>"
+CQE = "<=="
+RULE_CHECK = "==="
+b_SQE = SQE.encode()
+b_RULE_CHECK = RULE_CHECK.encode()
+
+NS_PER_SECOND = 1_000_000_000
+
+# Seconds since epoch of every date already seen, a log only spans a few days
+_date_seconds: Dict[str, int] = {}
+
+def parse_timestamp(timestamp: str) -> Tuple[int, int]:
+    '''
+    "2024-05-01 10:00:00.123456" -> (nanoseconds since epoch, digits of the fraction)
+    '''
+    date, _, clock = timestamp.partition(" ")
+    day_seconds = _date_seconds.get(date)
+    if day_seconds is None:
+        day_seconds = _date_seconds[date] = calendar.timegm(time.strptime(date, "%Y-%m-%d"))
+    hms, _, fraction = clock.partition(".")
+    hours, minutes, seconds = hms.split(":")
+    seconds = day_seconds + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    return seconds * NS_PER_SECOND + int(fraction[:9].ljust(9, "0")), len(fraction)
+
+def format_timestamp(ts_ns: int, ts_digits: int = 6) -> str:
+    seconds, nanoseconds = divmod(ts_ns, NS_PER_SECOND)
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+    if ts_digits:
+        timestamp += "." + f"{nanoseconds:09d}"[:ts_digits].ljust(ts_digits, "0")
+    return timestamp
+
+def parse_code(value: Optional[str]):
+    '''
+    SC/SCT values to int ("0x2" -> 2), non numeric values are kept as strings.
+    '''
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value, 16) if value[:2] in ("0x", "0X") else int(value)
+    except ValueError:
+        return sys.intern(value)
+
+def format_code(code) -> Optional[str]:
+    if isinstance(code, int):
+        return f"{code:#x}"
+    return code
+
+# Marks the SQE/CQE details not decoded yet, Ellipsis survives pickling as the same object
+UNPARSED = ...
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+class DATLine:
+    '''
+    One matched DAT line. Uses __slots__, integer nanosecond timestamps (ts_ns),
+    float time_ms, numeric SC/SCT codes and interned repeated values to keep
+    millions of entries in memory. timestamp, sc and sct are still available
+    as strings through properties.
+    command/params (SQE) and sc/sct (CQE) are decoded from the details the
+    first time they are read, details themselves can be kept as bytes by the
+    mmap scanner and are decoded on first access too.
+    '''
+    __slots__ = ("ts_ns", "ts_digits", "pid", "rid", "cycle_id", "time_ms", "direction", "result",
+                 "number", "rule", "_details", "filename", "_sc_code", "_sct_code", "_command", "_params")
+
+    REPR_FIELDS = ("timestamp", "pid", "rid", "cycle_id", "time_ms", "direction", "result", "number",
+                   "rule", "details", "filename", "sc", "sct", "command", "params")
+
+    def __init__(self, timestamp: Optional[str] = None, pid: Optional[str] = None, rid: Optional[str] = None,
+                 cycle_id: Optional[str] = None, time_ms: Optional[str] = None, direction: Optional[str] = None,
+                 result: Optional[str] = None, number: Optional[str] = None, rule: Optional[str] = None,
+                 details=None, filename: Optional[str] = None,
+                 sc: Optional[str] = None, sct: Optional[str] = None,
+                 command: Optional[str] = None, params: Optional[Dict[str, str]] = None) -> None:
+        self.timestamp = timestamp
+        self.pid = _intern(pid)
+        self.rid = _intern(rid)
+        self.cycle_id = cycle_id
+        self.time_ms = float(time_ms) if time_ms is not None else None
+        self.direction = _intern(direction)
+        self.result = _intern(result)
+        self.number = number
+        self.rule = _intern(rule)
+        self.details = details
+        self.filename = _intern(filename)
+        # CQE
+        lazy_cqe = direction == CQE and sc is None and sct is None
+        self._sc_code = UNPARSED if lazy_cqe else parse_code(sc)
+        self._sct_code = UNPARSED if lazy_cqe else parse_code(sct)
+        # SQE
+        lazy_sqe = direction == SQE and command is None and params is None
+        self._command = UNPARSED if lazy_sqe else _intern(command)
+        self._params = UNPARSED if lazy_sqe else params
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        if self.ts_ns is None:
+            return None
+        return format_timestamp(self.ts_ns, self.ts_digits)
+
+    @timestamp.setter
+    def timestamp(self, value: Optional[str]) -> None:
+        if value is None:
+            self.ts_ns, self.ts_digits = None, 0
+        else:
+            self.ts_ns, self.ts_digits = parse_timestamp(value)
+
+    @property
+    def details(self) -> Optional[str]:
+        details = self._details
+        if isinstance(details, bytes):
+            details = self._details = details.decode()
+        return details
+
+    @details.setter
+    def details(self, value) -> None:
+        self._details = value
+
+    @property
+    def command(self) -> Optional[str]:
+        if self._command is UNPARSED:
+            self.populate_SQE_attr()
+        return self._command
+
+    @command.setter
+    def command(self, value: Optional[str]) -> None:
+        self._command = _intern(value)
+
+    @property
+    def params(self) -> Optional[Dict[str, str]]:
+        if self._params is UNPARSED:
+            self.populate_SQE_attr()
+        return self._params
+
+    @params.setter
+    def params(self, value: Optional[Dict[str, str]]) -> None:
+        self._params = value
+
+    @property
+    def sc_code(self):
+        if self._sc_code is UNPARSED:
+            self.populate_CQE_attr()
+        return self._sc_code
+
+    @sc_code.setter
+    def sc_code(self, value) -> None:
+        self._sc_code = value
+
+    @property
+    def sct_code(self):
+        if self._sct_code is UNPARSED:
+            self.populate_CQE_attr()
+        return self._sct_code
+
+    @sct_code.setter
+    def sct_code(self, value) -> None:
+        self._sct_code = value
+
+    @property
+    def sc(self) -> Optional[str]:
+        return format_code(self.sc_code)
+
+    @sc.setter
+    def sc(self, value: Optional[str]) -> None:
+        self.sc_code = parse_code(value)
+
+    @property
+    def sct(self) -> Optional[str]:
+        return format_code(self.sct_code)
+
+    @sct.setter
+    def sct(self, value: Optional[str]) -> None:
+        self.sct_code = parse_code(value)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.REPR_FIELDS)
+        return f"DATLine({fields})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DATLine):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.REPR_FIELDS)
+
+    __hash__ = None
+
+    def populate_more_details(self) -> None:
+        if self.direction == SQE:
+            self.populate_SQE_attr()
+        elif self.direction == CQE:
+            self.populate_CQE_attr()
+
+    def populate_SQE_attr(self) -> None:
+        self._command = self._params = None
+        sqe = self.details.strip(" ")
+        match = sqe_pattern.match(sqe)
+        if match:
+            entry = match.groupdict()
+            param_matches = param_pattern.findall(entry["params"])
+            param_dict = {sys.intern(m[0]): m[1] for m in param_matches}
+            self._command = sys.intern(entry["command"])
+            self._params = param_dict
+
+    def populate_CQE_attr(self) -> None:
+        details = self.details
+        param_matches = param_pattern.findall(details)
+        param_dict = {m[0]: m[1] for m in param_matches}
+        self._sc_code = parse_code(param_dict.get("SC", None))
+        self._sct_code = parse_code(param_dict.get("SCT", None))
+
+
+dat_pattern = re.compile(
+    r'^(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+)\s+'
+    r'(?P<pid>\S+)\s+(?P<rid>\S+)\s+(?P<cycle_id>\S+)\s*'
+    r'(?P<time_ms>\d*\.\d+)?\s*'
+    r'(?P<direction>(==>|<==|===))\s*'
+    r'(?P<result>(Fail|Pass))?\s*'
+    r'(?P<number>#\d+\s+)?\s*'
+    r'(?P<rule>([A-Z0-9_]+))?'
+    r'(?P<details>.*)$'
+)
+
+# Same pattern for the mmap scanner, MULTILINE so ^ matches at every line start
+dat_pattern_bytes = re.compile(dat_pattern.pattern.encode(), re.MULTILINE)
+DAT_GROUPS = ("timestamp", "pid", "rid", "cycle_id", "time_ms", "direction", "result", "number", "rule")
+
+sqe_pattern = re.compile(
+    r'^(?P<command>\w+)\('
+    r'(?P<params>[^)]+)\)'
+)
+
+param_pattern = re.compile(
+    r'(\w+)=(0x[0-9a-fA-F]+|\d+|\w+)'
+)
+
+
+class LinePrescreen:
+    '''
+    Cheap substring checks done on the raw line before dat_pattern, lines that
+    can not be part of the query are dropped without running the regex.
+    directions: keep only these directions (SQE, CQE, RULE_CHECK)
+    commands: SQE lines must contain "<command>(", other directions are kept
+    params: SQE lines must contain every "<param>=<value>" ("<param>=" when value is None), other directions are kept
+    rules: rule check lines must contain one of the rules, other directions are kept
+    results: rule check lines must contain one of the results (Fail, Pass), other directions are kept
+    pids: lines must contain " <pid> " for one of the pids
+    A line passing the prescreen can still not match, the query checks the parsed fields again.
+    '''
+    def __init__(self, directions: Optional[Iterable[str]] = None, commands: Optional[Iterable[str]] = None,
+                 rules: Optional[Iterable[str]] = None, results: Optional[Iterable[str]] = None,
+                 params: Optional[Dict[str, str]] = None, pids: Optional[Iterable[str]] = None) -> None:
+        self.directions = tuple(directions) if directions else None
+        self.commands = tuple(f"{command}(" for command in commands) if commands else None
+        self.rules = tuple(rules) if rules else None
+        self.results = tuple(results) if results else None
+        self.params = tuple(f"{param}={value if value is not None else ''}" for param, value in params.items()) if params else None
+        self.pids = tuple(f" {pid} " for pid in pids) if pids else None
+        # bytes tokens for the mmap scanner
+        self.b_directions = self._encode(self.directions)
+        self.b_commands = self._encode(self.commands)
+        self.b_rules = self._encode(self.rules)
+        self.b_results = self._encode(self.results)
+        self.b_params = self._encode(self.params)
+        self.b_pids = self._encode(self.pids)
+
+    @staticmethod
+    def _encode(tokens: Optional[Tuple[str, ...]]) -> Optional[Tuple[bytes, ...]]:
+        return tuple(token.encode() for token in tokens) if tokens else None
+
+    def __call__(self, line: str) -> bool:
+        if self.directions and not any(direction in line for direction in self.directions):
+            return False
+        if self.pids and not any(pid in line for pid in self.pids):
+            return False
+        if SQE in line:
+            if self.commands and not any(command in line for command in self.commands):
+                return False
+            if self.params and not all(param in line for param in self.params):
+                return False
+        elif RULE_CHECK in line:
+            if self.rules and not any(rule in line for rule in self.rules):
+                return False
+            if self.results and not any(result in line for result in self.results):
+                return False
+        return True
+
+    def check_range(self, buffer, start: int, end: int) -> bool:
+        '''
+        Same checks on buffer[start:end] without copying the line out of the buffer.
+        '''
+        def has(token: bytes) -> bool:
+            return buffer.find(token, start, end) != -1
+
+        if self.b_directions and not any(has(direction) for direction in self.b_directions):
+            return False
+        if self.b_pids and not any(has(pid) for pid in self.b_pids):
+            return False
+        if has(b_SQE):
+            if self.b_commands and not any(has(command) for command in self.b_commands):
+                return False
+            if self.b_params and not all(has(param) for param in self.b_params):
+                return False
+        elif has(b_RULE_CHECK):
+            if self.b_rules and not any(has(rule) for rule in self.b_rules):
+                return False
+            if self.b_results and not any(has(result) for result in self.b_results):
+                return False
+        return True
+
+
+def get_compression(logfile: str) -> Optional[str]:
+    for suffix in COMPRESSED_SUFFIXES:
+        if logfile.endswith(suffix):
+            return suffix
+    return None
+
+def is_readable_dat_file(filename: str) -> bool:
+    if not filename.startswith(DAT_PREFIX):
+        return False
+    if get_compression(filename) == '.zst' and zstandard is None:
+        print(f"Skip {filename}: install zstandard to read .zst DAT files")
+        return False
+    return True
+
+@contextmanager
+def open_dat_file(logfile: str):
+    '''
+    Text stream of a plain or compressed DAT file, compressed files are
+    decompressed in chunks while reading, nothing is inflated to disk.
+    '''
+    compression = get_compression(logfile)
+    if compression == '.gz':
+        f = gzip.open(logfile, 'rt')
+    elif compression == '.xz':
+        f = lzma.open(logfile, 'rt')
+    elif compression == '.zst':
+        raw = open(logfile, 'rb')
+        f = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    else:
+        f = open(logfile)
+    with f:
+        yield f
+
+# Function to get all drive_access_tracker* files from a directory
+def get_drive_access_tracker_files(directory):
+    try:
+        # scandir gives the entry type with the listing, no stat per file on the mount
+        with os.scandir(directory) as it:
+            dat_files = [entry.path for entry in it if is_readable_dat_file(entry.name) and entry.is_file()]
+        return dat_files
+    except FileNotFoundError:
+        print("Exit: That directory was not found")
+
+def scan_buffer(buffer, filename: str, start: int = 0, end: Optional[int] = None,
+                prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    '''
+    Runs dat_pattern_bytes line by line directly over a bytes-like buffer
+    (an mmap of the DAT file). Only the short fields are decoded here,
+    details stay as bytes until a query reads them.
+    '''
+    if end is None:
+        end = len(buffer)
+    position = start
+    while position < end:
+        newline = buffer.find(b"\n", position, end)
+        line_end = next_line = end if newline == -1 else newline
+        if newline != -1:
+            next_line += 1
+        # Same as the universal newlines of text mode
+        if line_end > position and buffer[line_end - 1] == 13:
+            line_end -= 1
+        if prescreen and not prescreen.check_range(buffer, position, line_end):
+            position = next_line
+            continue
+        match = dat_pattern_bytes.match(buffer, position, line_end)
+        position = next_line
+        if not match:
+            continue
+        fields = [value.decode() if value is not None else None for value in match.group(*DAT_GROUPS)]
+        yield DATLine(*fields, details=match.group("details"), filename=filename)
+
+def iter_file_entries_mmap(logfile: str, prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    filename = os.path.basename(logfile)
+    with open(logfile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from scan_buffer(buffer, filename, prescreen=prescreen)
+
+def iter_file_entries(logfile: str, prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    if USE_MMAP and not get_compression(logfile):
+        return iter_file_entries_mmap(logfile, prescreen)
+    return iter_file_entries_text(logfile, prescreen)
+
+def iter_file_entries_text(logfile: str, prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    filename = os.path.basename(logfile)
+    with open_dat_file(logfile) as f:
+        try:
+            for line in f:
+                if prescreen and not prescreen(line):
+                    continue
+                match = dat_pattern.match(line)
+                if match:
+                    entry = match.groupdict()
+                    entry['filename'] = filename
+                    yield DATLine(**entry)
+        except EOFError:
+            # Compressed copy of an aborted run, keep what was written
+            print(f"{filename}: compressed stream ends early, file is truncated")
+
+def iter_entries(logfiles: Iterable[str], ordered: bool = False,
+                 prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    '''
+    Streams DATLine entries one file after the other, or merged by
+    timestamp across all files when ordered=True (every file is already
+    chronological, so the merge only holds one line per file in memory).
+    '''
+    streams = [iter_file_entries(logfile, prescreen) for logfile in logfiles]
+    if ordered:
+        return heapq.merge(*streams, key=lambda dat_line: dat_line.ts_ns)
+    return itertools.chain.from_iterable(streams)
+
+def get_entries(logfiles, jobs: int = 1) -> List[DATLine]:
+    '''
+    Entries of every file merged by timestamp, the order does not depend on jobs.
+    '''
+    if jobs != 1:
+        return list(iter_entries_parallel(logfiles, jobs))
+    return list(iter_entries(logfiles, ordered=True))
+
+
+# ----- Parallel parsing --------
+def split_file(logfile: str, chunk_size: int = PARALLEL_CHUNK_SIZE) -> List[Tuple[str, int, int]]:
+    '''
+    Splits a file in (logfile, start, end) byte ranges of about chunk_size,
+    every range starts at the beginning of a line.
+    Compressed files can not be split, they are a single range.
+    '''
+    file_size = os.path.getsize(logfile)
+    if get_compression(logfile):
+        return [(logfile, 0, file_size)]
+    ranges = []
+    start = 0
+    with open(logfile, 'rb') as f:
+        while start < file_size:
+            end = start + chunk_size
+            if end >= file_size:
+                end = file_size
+            else:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((logfile, start, end))
+            start = end
+    return ranges
+
+def parse_file_range(file_range: Tuple[str, int, int], prescreen: Optional[LinePrescreen] = None) -> List[DATLine]:
+    logfile, start, end = file_range
+    filename = os.path.basename(logfile)
+    if start == end:
+        return []
+    if get_compression(logfile):
+        return list(iter_file_entries_text(logfile, prescreen))
+    with open(logfile, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return list(scan_buffer(buffer, filename, start, end, prescreen))
+
+def parse_files_parallel(logfiles: Iterable[str], jobs: Optional[int] = None,
+                         prescreen: Optional[LinePrescreen] = None) -> Dict[str, List[DATLine]]:
+    '''
+    Parses the files (or byte ranges of the big ones) in a process pool,
+    jobs=None uses every core. Returns the entries of every file in file order.
+    '''
+    file_ranges = [file_range for logfile in logfiles for file_range in split_file(logfile)]
+    entries_by_file: Dict[str, List[DATLine]] = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # map() keeps the order of the ranges, so every file stays chronological
+        for (logfile, _, _), dat_entries in zip(file_ranges, executor.map(partial(parse_file_range, prescreen=prescreen), file_ranges)):
+            entries_by_file.setdefault(logfile, []).extend(dat_entries)
+    return entries_by_file
+
+def iter_entries_parallel(logfiles: Iterable[str], jobs: Optional[int] = None,
+                          prescreen: Optional[LinePrescreen] = None) -> Iterator[DATLine]:
+    entries_by_file = parse_files_parallel(logfiles, jobs, prescreen)
+    return heapq.merge(*entries_by_file.values(), key=lambda dat_line: dat_line.ts_ns)
+
+
+# ----- Generator stages, chain them as: iter_entries -> filter_* -> consumer --------
+def filter_direction(dat_entries: Iterable[DATLine], direction: str) -> Iterator[DATLine]:
+    return (dat_line for dat_line in dat_entries if dat_line.direction == direction)
+
+def filter_rule(dat_entries: Iterable[DATLine], rule: str, result: Optional[str] = None) -> Iterator[DATLine]:
+    for dat_line in dat_entries:
+        if dat_line.rule != rule:
+            continue
+        if result and dat_line.result != result:
+            continue
+        yield dat_line
+
+def filter_command(dat_entries: Iterable[DATLine], command: str) -> Iterator[DATLine]:
+    for dat_line in dat_entries:
+        if dat_line.direction == SQE and dat_line.command == command:
+            yield dat_line
+
+# Cycle ids are only unique inside one DAT file, a cycle is (filename, cycle_id)
+CycleKey = Tuple[str, str]
+
+def get_cycle_key(dat_line: DATLine) -> CycleKey:
+    return (dat_line.filename, dat_line.cycle_id)
+
+def filter_cycle_ids(dat_entries: Iterable[DATLine], cycle_keys: Set[CycleKey]) -> Iterator[DATLine]:
+    return (dat_line for dat_line in dat_entries if get_cycle_key(dat_line) in cycle_keys)
+
+def get_failed_cycle_ids(dat_entries: Iterable[DATLine], rule: str) -> Set[CycleKey]:
+    return {get_cycle_key(dat_line) for dat_line in filter_rule(dat_entries, rule, result="Fail")}
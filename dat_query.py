@@ -0,0 +1,220 @@
+import heapq
+import itertools
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Optional, Iterable, Iterator, Set
+
+from dat_parser import (DATLine, SQE, CQE, RULE_CHECK, NS_PER_SECOND, LinePrescreen, iter_file_entries,
+                        parse_code, parse_timestamp)
+from dat_index import CycleIndex
+from dat_offsets import iter_file_time_range
+
+
+ALL_DIRECTIONS = (SQE, CQE, RULE_CHECK)
+DIRECTION_NAMES = {"SQE": SQE, "CQE": CQE, "RULE": RULE_CHECK, SQE: SQE, CQE: CQE, RULE_CHECK: RULE_CHECK}
+
+QUERY_HELP = '''filters as key=value, a comma separated value means any of them:
+  direction=SQE|CQE|RULE  rule=ABCD_0001  result=Fail|Pass  command=write,read
+  param.<name>=<value> (SQE params, e.g. param.nsid=1)  file=<part of the file path>  pid=1000
+  since="YYYY-MM-DD HH:MM:SS.ffffff"  until="..."  around="..." window=<seconds>
+  rule/result with command/param: the cycles whose SQE and rule check both match'''
+
+
+@dataclass
+class DATQuery:
+    '''
+    Filters on the DAT lines, every filter must match (rule/result only match
+    rule check lines, command/params only SQE lines). Both together join
+    through the cycle: the lines of the cycles with a matching SQE and a
+    matching rule check, grouped by cycle. run() pushes them down:
+    file names pick the files, the offset index the byte range of the time
+    window and LinePrescreen drops the lines before the regex, the parsed
+    fields are checked last.
+    '''
+    directions: List[str] = field(default_factory=list)
+    rules: List[str] = field(default_factory=list)
+    results: List[str] = field(default_factory=list)
+    commands: List[str] = field(default_factory=list)
+    # param -> any of these values
+    params: Dict[str, List[str]] = field(default_factory=dict)
+    files: List[str] = field(default_factory=list)
+    pids: List[str] = field(default_factory=list)
+    start_ns: Optional[int] = None
+    end_ns: Optional[int] = None
+
+    @property
+    def joins_cycles(self) -> bool:
+        return bool((self.commands or self.params) and (self.rules or self.results))
+
+    def get_directions(self) -> Set[str]:
+        directions = set(self.directions or ALL_DIRECTIONS)
+        if self.joins_cycles:
+            return directions
+        if self.commands or self.params:
+            directions &= {SQE}
+        if self.rules or self.results:
+            directions &= {RULE_CHECK}
+        return directions
+
+    def get_prescreen(self) -> LinePrescreen:
+        directions = self.get_directions()
+        if self.joins_cycles:
+            directions |= {SQE, RULE_CHECK}
+        # Numbers are compared by value (nsid=1 matches nsid=0x1) and a value list matches any of its
+        # values, the raw line can only be checked for the name then
+        params = {param: values[0] if len(values) == 1 and isinstance(parse_code(values[0]), str) else None
+                  for param, values in self.params.items()}
+        return LinePrescreen(directions=directions if len(directions) < len(ALL_DIRECTIONS) else None,
+                             commands=self.commands, rules=self.rules, results=self.results,
+                             params=params, pids=self.pids)
+
+    def select_files(self, logfiles: Iterable[str]) -> List[str]:
+        '''
+        file= is matched on the path here, the entries only know the file name.
+        '''
+        if not self.files:
+            return list(logfiles)
+        return [logfile for logfile in logfiles if any(part in logfile for part in self.files)]
+
+    def matches(self, dat_line: DATLine) -> bool:
+        if dat_line.direction not in self.get_directions():
+            return False
+        return self.matches_fields(dat_line)
+
+    def matches_fields(self, dat_line: DATLine) -> bool:
+        '''
+        Every filter but the direction, the side of a cycle join that is not printed still has to match.
+        '''
+        if self.start_ns is not None and dat_line.ts_ns < self.start_ns:
+            return False
+        if self.end_ns is not None and dat_line.ts_ns > self.end_ns:
+            return False
+        if dat_line.direction == RULE_CHECK:
+            if self.rules and dat_line.rule not in self.rules:
+                return False
+            if self.results and dat_line.result not in self.results:
+                return False
+        if dat_line.direction == SQE:
+            if self.commands and dat_line.command not in self.commands:
+                return False
+            if self.params:
+                params = dat_line.params or {}
+                if not all(param in params and parse_code(params[param]) in map(parse_code, values)
+                           for param, values in self.params.items()):
+                    return False
+        if self.pids and dat_line.pid not in self.pids:
+            return False
+        if self.files and not any(part in dat_line.filename for part in self.files):
+            return False
+        return True
+
+    def filter(self, dat_entries: Iterable[DATLine]) -> Iterator[DATLine]:
+        '''
+        Same query over entries already in memory.
+        '''
+        directions = self.get_directions()
+        if not directions:
+            return iter(())
+        if self.joins_cycles:
+            # Only the lines matching on their own are indexed
+            return self.run_index(CycleIndex(dat_line for dat_line in dat_entries if self.matches_fields(dat_line)))
+        return (dat_line for dat_line in dat_entries if self.matches(dat_line))
+
+    def run(self, logfiles: Iterable[str], ordered: bool = False) -> Iterator[DATLine]:
+        if not self.get_directions():
+            return iter(())
+        prescreen = self.get_prescreen()
+        streams = []
+        for logfile in self.select_files(logfiles):
+            if self.start_ns is not None or self.end_ns is not None:
+                streams.append(iter_file_time_range(logfile, self.start_ns, self.end_ns, prescreen))
+            else:
+                streams.append(iter_file_entries(logfile, prescreen))
+        if ordered:
+            dat_entries = heapq.merge(*streams, key=lambda dat_line: dat_line.ts_ns)
+        else:
+            dat_entries = itertools.chain.from_iterable(streams)
+        # The files are already picked by their path, the lines only have the file name
+        return replace(self, files=[]).filter(dat_entries)
+
+    def run_index(self, cycle_index: CycleIndex) -> Iterator[DATLine]:
+        '''
+        Same query over a CycleIndex, rule=... result=Fail only visits the
+        failed cycles of the rules.
+        '''
+        directions = self.get_directions()
+        if not directions:
+            return
+        if self.rules and self.results == ["Fail"]:
+            cycle_keys = dict.fromkeys(key for rule in self.rules
+                                       for key in cycle_index.failed_cycle_ids.get(rule, {}))
+            cycles = (cycle_index.cycles[key] for key in cycle_keys)
+        else:
+            cycles = cycle_index.cycles.values()
+        for cycle in cycles:
+            if self.joins_cycles:
+                if cycle.sqe is None or not self.matches_fields(cycle.sqe):
+                    continue
+                if not any(self.matches_fields(dat_line) for dat_line in cycle.rule_checks):
+                    continue
+            if SQE in directions and cycle.sqe is not None and self.matches(cycle.sqe):
+                yield cycle.sqe
+            if CQE in directions and cycle.cqe is not None and self.matches(cycle.cqe):
+                yield cycle.cqe
+            if RULE_CHECK in directions:
+                yield from (dat_line for dat_line in cycle.rule_checks if self.matches(dat_line))
+
+
+def parse_query(expressions: Iterable[str]) -> DATQuery:
+    '''
+    ["direction=SQE", "command=write,read", "param.nsid=1"] -> DATQuery,
+    raises ValueError on an unknown key or a bad value.
+    '''
+    query = DATQuery()
+    around_ns = None
+    window_ns = NS_PER_SECOND
+    for expression in expressions:
+        name, separator, value = expression.partition("=")
+        name, value = name.strip(), value.strip()
+        # SQE param names are case sensitive, only the key itself is not
+        key = name.lower()
+        if not separator or not value:
+            raise ValueError(f"Expected key=value, got '{expression}'")
+        values = [item.strip() for item in value.split(",") if item.strip()]
+        if key == "direction":
+            for direction in values:
+                if direction.upper() not in DIRECTION_NAMES:
+                    raise ValueError(f"Unknown direction '{direction}', use SQE, CQE or RULE")
+                query.directions.append(DIRECTION_NAMES[direction.upper()])
+        elif key == "rule":
+            query.rules += values
+        elif key == "result":
+            query.results += [result.capitalize() for result in values]
+        elif key == "command":
+            query.commands += values
+        elif key.startswith("param."):
+            query.params.setdefault(name[len("param."):], []).extend(values)
+        elif key == "file":
+            query.files += values
+        elif key == "pid":
+            query.pids += values
+        elif key in ("since", "until", "around"):
+            try:
+                ts_ns = parse_timestamp(value)[0]
+            except ValueError:
+                raise ValueError(f"Bad timestamp '{value}', use YYYY-MM-DD HH:MM:SS.ffffff")
+            if key == "since":
+                query.start_ns = ts_ns
+            elif key == "until":
+                query.end_ns = ts_ns
+            else:
+                around_ns = ts_ns
+        elif key == "window":
+            window_ns = int(float(value) * NS_PER_SECOND)
+        else:
+            raise ValueError(f"Unknown filter '{name}'")
+    if around_ns is not None:
+        query.start_ns = around_ns - window_ns
+        query.end_ns = around_ns + window_ns
+    if not query.get_directions():
+        raise ValueError("No line can match: rule/result only match RULE lines, command/param only SQE lines")
+    return query
@@ -0,0 +1,258 @@
+import os
+import io
+import json
+import socket
+import argparse
+import threading
+import contextlib
+import socketserver
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+from dat_parser import DATLine, get_drive_access_tracker_files, get_cycle_key
+from dat_index import CycleIndex, SQETimeline
+from dat_query import parse_query
+from parse_dat_files_class import NUM_SQE_BEFORE, load_entries, report_failed_rule
+
+
+DAT_SERVER_SOCKET = os.environ.get("DAT_SERVER_SOCKET", os.path.join(os.path.expanduser("~"), ".cache", "dat_server.sock"))
+DAT_SERVER_MEMORY_MB = int(os.environ.get("DAT_SERVER_MEMORY_MB", 4096))
+# Rough size of one loaded DATLine with its share of the indexes
+BYTES_PER_ENTRY = 600
+# Lines printed at most for a "where" query
+MAX_QUERY_LINES = 1000
+
+
+class DATSet:
+    '''
+    Entries and indexes of one DAT directory, loaded once and kept in memory.
+    '''
+    def __init__(self, directory: str, jobs: int = 1, context_by: Optional[str] = None) -> None:
+        self.directory = directory
+        self.dat_files = get_drive_access_tracker_files(directory) or []
+        self.signature = get_signature(self.dat_files)
+        self.entries: List[DATLine] = load_entries(self.dat_files, jobs) if self.dat_files else []
+        self.cycle_index = CycleIndex(self.entries)
+        self.sqe_timeline = SQETimeline(self.entries, group_by=context_by)
+
+    @property
+    def size(self) -> int:
+        return len(self.entries) * BYTES_PER_ENTRY
+
+    def is_stale(self) -> bool:
+        return get_signature(get_drive_access_tracker_files(self.directory) or []) != self.signature
+
+
+def get_signature(dat_files: List[str]) -> Tuple:
+    signature = []
+    for dat_file in sorted(dat_files):
+        try:
+            stat = os.stat(dat_file)
+        except OSError:
+            continue
+        signature.append((dat_file, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class DATSets:
+    '''
+    DAT sets by directory, least recently used ones are dropped when the
+    estimated size of all of them goes over memory_mb.
+    '''
+    def __init__(self, memory_mb: int = DAT_SERVER_MEMORY_MB, jobs: int = 1, context_by: Optional[str] = None) -> None:
+        self.max_bytes = memory_mb * 1024 * 1024
+        self.jobs = jobs
+        self.context_by = context_by
+        self.dat_sets: "OrderedDict[str, DATSet]" = OrderedDict()
+
+    def get(self, directory: str) -> DATSet:
+        dat_set = self.dat_sets.get(directory)
+        if dat_set is not None and dat_set.is_stale():
+            print(f"{directory} changed, loading it again")
+            del self.dat_sets[directory]
+            dat_set = None
+        if dat_set is None:
+            dat_set = self.dat_sets[directory] = DATSet(directory, self.jobs, self.context_by)
+            self.evict(keep=directory)
+        self.dat_sets.move_to_end(directory)
+        return dat_set
+
+    def evict(self, keep: str) -> None:
+        total = sum(dat_set.size for dat_set in self.dat_sets.values())
+        for directory in list(self.dat_sets):
+            if total <= self.max_bytes:
+                break
+            if directory == keep:
+                continue
+            total -= self.dat_sets.pop(directory).size
+            print(f"Dropped {directory} from memory")
+
+    def status(self) -> None:
+        total = 0
+        for directory, dat_set in self.dat_sets.items():
+            total += dat_set.size
+            print(f"{directory}: {len(dat_set.dat_files)} files, {len(dat_set.entries)} entries, ~{dat_set.size // 2**20} MB")
+        print(f"~{total // 2**20} MB of {self.max_bytes // 2**20} MB")
+
+
+# ----- Queries, everything printed goes back to the client --------
+def query_rule(dat_set: DATSet, rules: List[str]) -> None:
+    for rule in rules or dat_set.cycle_index.failing_rules:
+        print("--------------------------------------------------------------------")
+        print(f"Rule {rule}")
+        report_failed_rule(dat_set.cycle_index, dat_set.sqe_timeline, rule)
+
+def query_failing(dat_set: DATSet, _: List[str]) -> None:
+    failed_cycle_ids = dat_set.cycle_index.failed_cycle_ids
+    for rule in sorted(failed_cycle_ids, key=lambda rule: len(failed_cycle_ids[rule]), reverse=True):
+        print(f"{rule}: {len(failed_cycle_ids[rule])} fails")
+
+def query_last(dat_set: DATSet, commands: List[str]) -> None:
+    '''
+    Last SQE of every command (of every command seen without arguments) and its CQE.
+    '''
+    last_sqes: Dict[str, DATLine] = {}
+    for sqes in dat_set.sqe_timeline.sqes.values():
+        for sqe in reversed(sqes):
+            if commands and sqe.command not in commands:
+                continue
+            last = last_sqes.get(sqe.command)
+            if last is None or sqe.ts_ns > last.ts_ns:
+                last_sqes[sqe.command] = sqe
+    if not last_sqes:
+        print("Command not found")
+    for command, sqe in sorted(last_sqes.items(), key=lambda item: item[1].ts_ns):
+        cqe = dat_set.cycle_index.get_cqe(get_cycle_key(sqe))
+        status = f"SCT={cqe.sct} SC={cqe.sc}" if cqe else "no CQE"
+        print(f"Last run of command {command}")
+        print(f"{sqe.timestamp} - {sqe.details} ({sqe.filename}, {status})")
+
+def query_context(dat_set: DATSet, args: List[str]) -> None:
+    '''
+    context CYCLE_ID [N]: the SQE of the cycle and the N commands before it,
+    for every DAT file that has that cycle id.
+    '''
+    if not args:
+        print("Usage: context CYCLE_ID [N]")
+        return
+    how_many = int(args[1]) if len(args) > 1 else NUM_SQE_BEFORE
+    cycle_index = dat_set.cycle_index
+    sqes = [sqe for sqe in map(cycle_index.get_sqe, cycle_index.find_cycle_id(args[0])) if sqe]
+    if not sqes:
+        print(f"No SQE with cycle id {args[0]}")
+        return
+    for sqe in sorted(sqes, key=lambda sqe: sqe.ts_ns):
+        key = get_cycle_key(sqe)
+        print(f"{sqe.filename}:")
+        for previous_sqe in reversed(dat_set.sqe_timeline.get_previous(sqe, how_many)):
+            print(f"   {previous_sqe.timestamp} - {previous_sqe.details}")
+        print(f"=> {sqe.timestamp} - {sqe.details}")
+        for dat_line in [cycle_index.get_cqe(key)] + cycle_index.cycles[key].rule_checks:
+            if dat_line is not None:
+                print(f"   {dat_line.timestamp} {dat_line.direction} {dat_line.result or ''} {dat_line.rule or ''}{dat_line.details}")
+
+def query_where(dat_set: DATSet, expressions: List[str]) -> None:
+    query = parse_query(expressions)
+    # Rule fails and rule/command joins come straight from the cycle index
+    if query.rules and query.results == ["Fail"] or query.joins_cycles:
+        matches = query.run_index(dat_set.cycle_index)
+    else:
+        matches = query.filter(dat_set.entries)
+    count = 0
+    for dat_line in matches:
+        count += 1
+        if count <= MAX_QUERY_LINES:
+            print(dat_line.filename, dat_line)
+    print(f"{count} entries")
+
+QUERIES = {
+    "rule": query_rule,
+    "failing": query_failing,
+    "last": query_last,
+    "context": query_context,
+    "where": query_where,
+}
+
+
+class DATRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    One JSON request per line: {"command": ..., "directory": ..., "args": [...]},
+    answered with {"output": ...}. One request at a time, the DAT sets are shared.
+    '''
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                output = self.server.answer(request)
+            except Exception as e:
+                output = f"Error: {e}\n"
+            self.wfile.write(json.dumps({"output": output}).encode() + b"\n")
+
+
+class DATServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, dat_sets: DATSets) -> None:
+        self.dat_sets = dat_sets
+        super().__init__(socket_path, DATRequestHandler)
+
+    def answer(self, request: dict) -> str:
+        command = request.get("command")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            if command == "status":
+                self.dat_sets.status()
+            elif command == "stop":
+                # shutdown() waits for serve_forever(), that is waiting for this request
+                threading.Thread(target=self.shutdown).start()
+                print("Stopping")
+            elif command in QUERIES:
+                dat_set = self.dat_sets.get(os.path.abspath(request["directory"]))
+                if not dat_set.dat_files:
+                    print(f"No DAT files in {dat_set.directory}")
+                else:
+                    QUERIES[command](dat_set, request.get("args", []))
+            else:
+                print(f"Unknown command {command}, use one of: {', '.join(list(QUERIES) + ['status', 'stop'])}")
+        return output.getvalue()
+
+
+def is_server_running(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+def serve(socket_path: str = DAT_SERVER_SOCKET, memory_mb: int = DAT_SERVER_MEMORY_MB, jobs: int = 1,
+          context_by: Optional[str] = None) -> None:
+    if is_server_running(socket_path):
+        print(f"A server is already listening on {socket_path}, stop it first with: python3 dat_client.py stop")
+        return
+    if os.path.exists(socket_path):
+        # Socket of a server that did not stop cleanly
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    with DATServer(socket_path, DATSets(memory_mb, jobs, context_by)) as server:
+        print(f"Listening on {socket_path}, {memory_mb} MB for DAT sets")
+        try:
+            server.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Keep DAT sets parsed in memory and answer dat_client.py queries")
+    parser.add_argument("--socket", default=DAT_SERVER_SOCKET, help="Unix socket to listen on")
+    parser.add_argument("--memory-mb", type=int, default=DAT_SERVER_MEMORY_MB,
+                        help="memory for the loaded DAT sets, least recently used ones are dropped over it")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="parse the DAT files in this many processes, 0 uses every core")
+    parser.add_argument("--context-by", choices=["filename", "pid"], default=None,
+                        help="only look for the previous commands in the same DAT file or pid")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    serve(args.socket, args.memory_mb, args.jobs, args.context_by)
@@ -0,0 +1,372 @@
+import math
+import heapq
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from dat_parser import DATLine, SQE, CQE, RULE_CHECK, NS_PER_SECOND, get_cycle_key
+
+
+@dataclass
+class ParamSupport:
+    param: str
+    value: str
+    fail_count: int
+    # Fraction of the failed SQEs with this param=value
+    support: float
+    # Same fraction expected from the passing SQEs of the same commands
+    baseline: float
+    lift: float
+
+
+class ParamSimilarity:
+    '''
+    Counts every (param, value) of all the failed SQEs of a rule and compares
+    it with the passing SQEs of the same command:
+    support = fails with the pair / fails
+    baseline = sum over commands of (fails of the command / fails) * (passes with the pair / passes) of that command
+    lift = support / baseline, > 1 means the pair shows up more in the failures
+    '''
+    def __init__(self, failed_sqes: Iterable[DATLine]) -> None:
+        self.fail_counts: Counter = Counter()
+        self.fails_by_command: Counter = Counter()
+        self.failed_cycle_ids = set()
+        for sqe in failed_sqes:
+            if sqe.command is None:
+                continue
+            self.failed_cycle_ids.add(get_cycle_key(sqe))
+            self.fails_by_command[sqe.command] += 1
+            self.fail_counts[("command", sqe.command)] += 1
+            self.fail_counts.update(sqe.params.items())
+        # Only the pairs seen in the failures are counted in the passing SQEs
+        self.pass_counts: Dict[str, Counter] = {command: Counter() for command in self.fails_by_command}
+        self.passes_by_command: Counter = Counter()
+
+    @property
+    def total_fails(self) -> int:
+        return sum(self.fails_by_command.values())
+
+    def add_baseline(self, dat_entries: Iterable[DATLine]) -> None:
+        fail_pairs = self.fail_counts.keys()
+        for dat_line in dat_entries:
+            if dat_line.direction != SQE or get_cycle_key(dat_line) in self.failed_cycle_ids:
+                continue
+            pass_counts = self.pass_counts.get(dat_line.command)
+            if pass_counts is None:
+                continue
+            self.passes_by_command[dat_line.command] += 1
+            pass_counts[("command", dat_line.command)] += 1
+            pass_counts.update(pair for pair in dat_line.params.items() if pair in fail_pairs)
+
+    def merge_failures(self, other: "ParamSimilarity") -> None:
+        '''
+        Adds the failures of other (another test), the baseline has to be
+        added with add_baseline_counts() once every failure is merged.
+        '''
+        self.fail_counts.update(other.fail_counts)
+        self.fails_by_command.update(other.fails_by_command)
+        for command in other.fails_by_command:
+            self.pass_counts.setdefault(command, Counter())
+
+    def add_failure_counts(self, failed_counts: Dict[str, Counter]) -> None:
+        '''
+        Adds the failed SQEs already counted by count_sqe_pairs(), same as
+        passing them to the constructor, the baseline then comes from
+        add_baseline_counts().
+        '''
+        for command, counts in failed_counts.items():
+            self.fails_by_command[command] += counts[("command", command)]
+            self.fail_counts.update(counts)
+            self.pass_counts.setdefault(command, Counter())
+
+    def add_baseline_counts(self, sqe_counts: Dict[str, Counter], failed_counts: Dict[str, Counter]) -> None:
+        '''
+        Same as add_baseline() from count_sqe_pairs() of every SQE of some
+        entries (sqe_counts) and of the failed SQEs of the rule in them
+        (failed_counts), the difference is what the passing SQEs have.
+        '''
+        fail_pairs = self.fail_counts.keys()
+        for command, pass_counts in self.pass_counts.items():
+            counts = sqe_counts.get(command)
+            if counts is None:
+                continue
+            failed = failed_counts.get(command, Counter())
+            self.passes_by_command[command] += counts[("command", command)] - failed[("command", command)]
+            for pair in fail_pairs:
+                count = counts[pair] - failed[pair]
+                if count > 0:
+                    pass_counts[pair] += count
+
+    def baseline(self, pair: Tuple[str, str]) -> float:
+        total_fails = self.total_fails
+        baseline = 0.0
+        for command, fails in self.fails_by_command.items():
+            passes = self.passes_by_command[command]
+            # Laplace smoothing, a pair never seen in the passing SQEs does not give an infinite lift
+            baseline += (fails / total_fails) * (self.pass_counts[command][pair] + 1) / (passes + 2)
+        return baseline
+
+    def rank(self, min_support: float = 0.0, top: int = 0) -> List[ParamSupport]:
+        total_fails = self.total_fails
+        if not total_fails:
+            return []
+        ranked = []
+        for (param, value), fail_count in self.fail_counts.items():
+            support = fail_count / total_fails
+            if support < min_support:
+                continue
+            baseline = self.baseline((param, value))
+            ranked.append(ParamSupport(param, value, fail_count, support, baseline, support / baseline))
+        ranked.sort(key=lambda item: (item.support, item.lift), reverse=True)
+        return ranked[:top] if top else ranked
+
+
+def count_sqe_pairs(sqes: Iterable[DATLine]) -> Dict[str, Counter]:
+    '''
+    command -> Counter of ("command", command) (the SQEs of the command) and
+    of every (param, value) of its SQEs, the pairs ParamSimilarity counts.
+    '''
+    sqe_counts: Dict[str, Counter] = {}
+    for sqe in sqes:
+        add_sqe_pairs(sqe_counts, sqe)
+    return sqe_counts
+
+def add_sqe_pairs(sqe_counts: Dict[str, Counter], sqe: DATLine) -> None:
+    '''
+    Adds one SQE to counts made by count_sqe_pairs(), used when entries keep arriving.
+    '''
+    if sqe.command is None:
+        return
+    counts = sqe_counts.get(sqe.command)
+    if counts is None:
+        counts = sqe_counts[sqe.command] = Counter()
+    counts[("command", sqe.command)] += 1
+    counts.update(sqe.params.items())
+
+
+class LatencySketch:
+    '''
+    Streaming quantiles with a log bucketed histogram (DDSketch like): every
+    quantile has a relative error under relative_accuracy, memory depends on
+    the range of the values, not on how many were added, and two sketches
+    merge by adding their buckets (files, workers).
+    '''
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets: Counter = Counter()
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def merge(self, other: "LatencySketch") -> None:
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class LatencyStats:
+    '''
+    Sketch plus the worst_k slowest (latency, filename, cycle_id) of one key.
+    '''
+    def __init__(self, worst_k: int = 5) -> None:
+        self.sketch = LatencySketch()
+        self.worst_k = worst_k
+        self.worst: List[Tuple[float, str, str]] = []
+
+    def add(self, latency_ms: float, filename: str, cycle_id: str) -> None:
+        self.sketch.add(latency_ms)
+        item = (latency_ms, filename, cycle_id)
+        if len(self.worst) < self.worst_k:
+            heapq.heappush(self.worst, item)
+        elif item > self.worst[0]:
+            heapq.heapreplace(self.worst, item)
+
+    def merge(self, other: "LatencyStats") -> None:
+        self.sketch.merge(other.sketch)
+        for item in other.worst:
+            if len(self.worst) < self.worst_k:
+                heapq.heappush(self.worst, item)
+            elif item > self.worst[0]:
+                heapq.heapreplace(self.worst, item)
+
+    def get_worst(self) -> List[Tuple[float, str, str]]:
+        return sorted(self.worst, reverse=True)
+
+
+# (command, param, value), param and value are None for the command totals
+LatencyKey = Tuple[str, Optional[str], Optional[str]]
+
+def collect_latencies(dat_entries: Iterable[DATLine], key_params: Iterable[str] = (), worst_k: int = 5,
+                      latencies: Optional[Dict[LatencyKey, LatencyStats]] = None) -> Dict[LatencyKey, LatencyStats]:
+    '''
+    Pairs every SQE with its CQE by (filename, cycle_id) while streaming, only
+    the SQEs still waiting for their CQE are kept. The latency is the time_ms
+    of the CQE when the DAT file logs it, otherwise the CQE - SQE timestamps.
+    '''
+    if latencies is None:
+        latencies = {}
+    key_params = tuple(key_params)
+    waiting_cqe: Dict[Tuple[str, str], DATLine] = {}
+    for dat_line in dat_entries:
+        if dat_line.direction == SQE:
+            waiting_cqe[(dat_line.filename, dat_line.cycle_id)] = dat_line
+            continue
+        if dat_line.direction != CQE:
+            continue
+        sqe = waiting_cqe.pop((dat_line.filename, dat_line.cycle_id), None)
+        if sqe is None or sqe.command is None:
+            continue
+        if dat_line.time_ms is not None:
+            latency_ms = dat_line.time_ms
+        else:
+            latency_ms = (dat_line.ts_ns - sqe.ts_ns) * 1000 / NS_PER_SECOND
+        keys = [(sqe.command, None, None)]
+        keys += [(sqe.command, param, sqe.params[param]) for param in key_params if param in sqe.params]
+        for key in keys:
+            stats = latencies.get(key)
+            if stats is None:
+                stats = latencies[key] = LatencyStats(worst_k)
+            stats.add(latency_ms, sqe.filename, sqe.cycle_id)
+    return latencies
+
+def merge_latencies(all_latencies: Iterable[Dict[LatencyKey, LatencyStats]]) -> Dict[LatencyKey, LatencyStats]:
+    merged: Dict[LatencyKey, LatencyStats] = {}
+    for latencies in all_latencies:
+        for key, stats in latencies.items():
+            if key in merged:
+                merged[key].merge(stats)
+            else:
+                merged[key] = stats
+    return merged
+
+
+@dataclass
+class SequenceScore:
+    sequence: Tuple[str, ...]
+    fail_count: int
+    # Fraction of the failures of the rule preceded by the sequence
+    fail_rate: float
+    # Fraction of all the SQEs preceded by the sequence
+    baseline_rate: float
+    ratio: float
+
+
+class FailureSequenceMiner:
+    '''
+    Single pass over the timestamp ordered entries. The n commands sent before
+    every SQE are its context (one window per file or pid with group_by),
+    contexts are counted for every SQE (baseline) and, when a rule check of
+    that cycle says Fail, for the rule. Commands can be bucketed by one param
+    (bucket_param="opcode" -> "write:opcode=0x1").
+    Memory is bounded: contexts waiting for their rule check are kept in an
+    LRU of max_pending, and the counters are pruned to their max_sequences/2
+    most common entries when they grow over max_sequences.
+    '''
+    def __init__(self, n: int = 3, bucket_param: Optional[str] = None, rules: Optional[Iterable[str]] = None,
+                 group_by: Optional[str] = None, max_pending: int = 100000, max_sequences: int = 200000) -> None:
+        self.n = n
+        self.bucket_param = bucket_param
+        self.rules = set(rules) if rules else None
+        self.group_by = group_by
+        self.max_pending = max_pending
+        self.max_sequences = max_sequences
+        self.windows: Dict[Optional[str], deque] = {}
+        self.pending: OrderedDict = OrderedDict()
+        self.baseline: Counter = Counter()
+        self.total_sqes = 0
+        self.fails: Dict[str, Counter] = {}
+        self.total_fails: Counter = Counter()
+
+    def get_token(self, sqe: DATLine) -> str:
+        command = sqe.command or "?"
+        if self.bucket_param and sqe.params and self.bucket_param in sqe.params:
+            return f"{command}:{self.bucket_param}={sqe.params[self.bucket_param]}"
+        return command
+
+    def add(self, dat_line: DATLine) -> None:
+        if dat_line.direction == SQE:
+            group = getattr(dat_line, self.group_by) if self.group_by else None
+            window = self.windows.get(group)
+            if window is None:
+                window = self.windows[group] = deque(maxlen=self.n)
+            if len(window) == self.n:
+                context = tuple(window)
+                self.baseline[context] += 1
+                self.total_sqes += 1
+                self.pending[(dat_line.filename, dat_line.cycle_id)] = context
+                if len(self.pending) > self.max_pending:
+                    self.pending.popitem(last=False)
+                if len(self.baseline) > self.max_sequences:
+                    self.prune()
+            window.append(self.get_token(dat_line))
+        elif dat_line.direction == RULE_CHECK and dat_line.result == "Fail":
+            if self.rules is not None and dat_line.rule not in self.rules:
+                return
+            context = self.pending.get((dat_line.filename, dat_line.cycle_id))
+            if context is None:
+                return
+            self.fails.setdefault(dat_line.rule, Counter())[context] += 1
+            self.total_fails[dat_line.rule] += 1
+
+    def prune(self) -> None:
+        keep = self.max_sequences // 2
+        self.fails = {rule: Counter(dict(fails.most_common(keep))) for rule, fails in self.fails.items()}
+        # Never drop a baseline count a failure depends on
+        failing = set().union(*self.fails.values())
+        kept = dict(self.baseline.most_common(keep))
+        kept.update({context: self.baseline[context] for context in failing})
+        self.baseline = Counter(kept)
+
+    def rank(self, rule: str, top: int = 10, min_fails: int = 2) -> List[SequenceScore]:
+        fails = self.fails.get(rule)
+        if not fails or not self.total_sqes:
+            return []
+        total_fails = self.total_fails[rule]
+        scores = []
+        for sequence, fail_count in fails.items():
+            if fail_count < min_fails:
+                continue
+            fail_rate = fail_count / total_fails
+            baseline_rate = max(self.baseline[sequence], fail_count) / self.total_sqes
+            scores.append(SequenceScore(sequence, fail_count, fail_rate, baseline_rate, fail_rate / baseline_rate))
+        scores.sort(key=lambda score: (score.ratio, score.fail_count), reverse=True)
+        return scores[:top]
+
+    @property
+    def failing_rules(self) -> List[str]:
+        return [rule for rule, _ in self.total_fails.most_common()]
@@ -0,0 +1,213 @@
+import os
+import gzip
+import shutil
+import fnmatch
+import argparse
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from dat_parser import COMPRESSED_SUFFIXES
+from gtax_except_fail_mount_with_link import (gtax_instances, get_drive_sn, get_failing_batch_seeds, COVERAGE_DIR,
+                                              EXCEPTIONS_FILE_NAME, RESULTS_FILE_NAME, TEST_JSON_DATA)
+
+
+# Files to get in the main directory
+FILES = (EXCEPTIONS_FILE_NAME, RESULTS_FILE_NAME, TEST_JSON_DATA, "summary.log", "parse_summary.txt")
+# Files to get in the SN directory
+FILES_SN = ("debug.log.gz", "debug.log", "dss_dump_end.log", "dss_dump_init.log", "drive_info.json",
+            "da_dump_init.log", "da_dump_end.log", "drive_config.json")
+DAT_PATTERNS = ["drive_access_tracker.*.log"] + [f"drive_access_tracker.*.log*{suffix}" for suffix in COMPRESSED_SUFFIXES]
+DAT_ABORTED_PATTERN = "drive_access_tracker.*.log.aborted"
+# Files copied at the same time
+FETCH_WORKERS = int(os.environ.get("GTAX_FETCH_WORKERS", 8))
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def is_unchanged(src_stat: os.stat_result, dst: str) -> bool:
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+def copy_data(src_fd: int, dst_fd: int, size: int) -> None:
+    '''
+    Kernel side copy, copy_file_range first, sendfile when the file systems
+    do not support it (SMB mounts can refuse it), a plain read/write last.
+    A way that fails or stops copying (some file systems return 0 from
+    copy_file_range for files they can not copy) hands over to the next one
+    at the same offset. Raises OSError if size bytes could not be copied.
+    '''
+    copied = 0
+    for copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if copy is None:
+            continue
+        try:
+            # sendfile writes at the position of dst_fd
+            os.lseek(dst_fd, copied, os.SEEK_SET)
+            while copied < size:
+                if copy is os.sendfile:
+                    sent = copy(dst_fd, src_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+                else:
+                    sent = copy(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - copied), copied, copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            pass
+        if copied == size:
+            return
+    with os.fdopen(os.dup(src_fd), "rb") as src, os.fdopen(os.dup(dst_fd), "wb") as dst:
+        src.seek(copied)
+        dst.seek(copied)
+        while copied < size:
+            data = src.read(min(COPY_CHUNK_SIZE, size - copied))
+            if not data:
+                break
+            dst.write(data)
+            copied += len(data)
+    if copied != size:
+        raise OSError(f"copied {copied} of {size} bytes")
+
+def copy_file(src: str, dst: str) -> bool:
+    '''
+    Copies src to dst keeping its mtime, nothing is done when dst already has
+    the same size and mtime. Returns True if the file was copied.
+    '''
+    src_stat = os.stat(src)
+    if is_unchanged(src_stat, dst):
+        return False
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    try:
+        with open(src, "rb") as src_file, open(tmp_path, "wb") as dst_file:
+            copy_data(src_file.fileno(), dst_file.fileno(), src_stat.st_size)
+        os.utime(tmp_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(tmp_path, dst)
+    except OSError:
+        # A short copy must not be left with the mtime of src, the next run would skip it
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+def list_files(directory: str) -> typing.List[str]:
+    try:
+        with os.scandir(directory) as it:
+            return [entry.name for entry in it if entry.is_file()]
+    except OSError:
+        return []
+
+def get_files_to_fetch(test_path: str, failing_only: bool = False) -> typing.List[str]:
+    '''
+    Paths of the test logs, the SN logs and the DAT files to fetch, with
+    failing_only just the DAT files of the failing batch seeds in results.log.
+    '''
+    test_files = list_files(test_path)
+    to_fetch = [os.path.join(test_path, name) for name in FILES if name in test_files]
+    sn = get_drive_sn(test_path)
+    if not sn:
+        return to_fetch
+    sn_path = os.path.join(test_path, sn)
+    sn_files = list_files(sn_path)
+    to_fetch += [os.path.join(sn_path, name) for name in FILES_SN if name in sn_files]
+
+    coverage_path = os.path.join(sn_path, COVERAGE_DIR)
+    patterns = list(DAT_PATTERNS)
+    # Aborted DAT files only matter when the test got an exception
+    if EXCEPTIONS_FILE_NAME in test_files:
+        patterns.append(DAT_ABORTED_PATTERN)
+    dat_files = [name for name in list_files(coverage_path) if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+    if failing_only:
+        seeds = get_failing_batch_seeds(os.path.join(test_path, RESULTS_FILE_NAME))
+        dat_files = [name for name in dat_files if any(f"{seed}.log" in name for seed in seeds)]
+    to_fetch += [os.path.join(coverage_path, name) for name in sorted(dat_files)]
+    return to_fetch
+
+def fetch_test_logs(test_path: str, directory: str, failing_only: bool = False,
+                    workers: int = FETCH_WORKERS) -> typing.Tuple[int, int]:
+    '''
+    Copies the logs of one test into directory, files already there with the
+    same size and mtime are skipped. Returns (copied, skipped).
+    '''
+    os.makedirs(directory, exist_ok=True)
+    to_fetch = get_files_to_fetch(test_path, failing_only)
+
+    def fetch(src: str) -> bool:
+        try:
+            return copy_file(src, os.path.join(directory, os.path.basename(src)))
+        except OSError as e:
+            print(f"Unable to copy {src}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        copied = list(executor.map(fetch, to_fetch))
+
+    # debug.log is inflated from the .gz only when the test has no debug.log of its own,
+    # the .gz is kept next to it so the next run can skip it
+    debug_gz = os.path.join(directory, "debug.log.gz")
+    debug_log = os.path.join(directory, "debug.log")
+    has_debug_log = any(os.path.basename(src) == "debug.log" for src in to_fetch)
+    if os.path.isfile(debug_gz) and not has_debug_log:
+        if not os.path.isfile(debug_log) or os.path.getmtime(debug_log) < os.path.getmtime(debug_gz):
+            with gzip.open(debug_gz, "rb") as src, open(debug_log, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+    return sum(copied), len(copied) - sum(copied)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Copy the logs of a GTAX test, asks for what is not given")
+    parser.add_argument("job_id", nargs="?", help="GTAX job id")
+    parser.add_argument("test", nargs="?", help="test of the job, 0 by default")
+    parser.add_argument("-i", "--instance", choices=list(gtax_instances), help="STAX instance")
+    parser.add_argument("--failing-only", action="store_true",
+                        help="only copy the DAT files of the Failing Batch Seed Numbers in results.log")
+    parser.add_argument("-j", "--workers", type=int, default=FETCH_WORKERS,
+                        help="files copied at the same time")
+    parser.add_argument("-o", "--output", default=None,
+                        help="directory to copy the logs to, <job id>_<test> by default")
+    return parser.parse_args()
+
+def ask_instance() -> typing.Optional[str]:
+    print("Select instance:")
+    instances = list(gtax_instances)
+    for number, instance in enumerate(instances, start=1):
+        print(f"{number}) STAX {instance}")
+    choice = input("\nEnter your choice: ")
+    if not choice.isdigit() or not 1 <= int(choice) <= len(instances):
+        return None
+    return instances[int(choice) - 1]
+
+def main():
+    args = parse_args()
+    instance = args.instance or ask_instance()
+    if not instance:
+        print("Not valid option, Exiting...")
+        return
+    mount_point = gtax_instances[instance]
+    if not os.path.isdir(mount_point):
+        print("Mount elements RCV logs first")
+        return
+
+    job_id = args.job_id or input("Enter job id: ")
+    if not os.path.isdir(f"{mount_point}/{job_id}"):
+        print("That job id doesnt exist")
+        return
+    test = args.test if args.test is not None else input("Test: ")
+    test = test or "0"
+    test_path = f"{mount_point}/{job_id}/{test}"
+    if not os.path.isdir(test_path):
+        print("That test doesnt exist or is too big so is in a zip")
+        print(f"Check: ls {mount_point}/{job_id}")
+        return
+
+    directory = args.output or f"{job_id}_{test}"
+    print("Getting logs ...")
+    copied, skipped = fetch_test_logs(test_path, directory, args.failing_only, args.workers)
+    print(f"{copied} files copied, {skipped} already up to date")
+    print(f"*Check: ls {mount_point}/{job_id}")
+    print(directory)
+
+if __name__ == '__main__':
+    main()
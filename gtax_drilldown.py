@@ -0,0 +1,187 @@
+import os
+import re
+import argparse
+import typing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from dat_parser import get_drive_access_tracker_files, get_cycle_key
+from dat_index import CycleIndex
+from dat_cache import get_cached_entries
+from dat_stats import ParamSimilarity, count_sqe_pairs
+from parse_dat_files_class import MIN_SUPPORT, NUM_INCIDENTS, print_param_support
+from gtax_except_fail_mount_with_link import (Job, CrawlManifest, RANGE_FORMAT, gtax_rcv_dat_logs_path, ask_job_id_range,
+                                              get_coverage_path, get_job_ids_by_id_range, get_test_ids_by_job_id,
+                                              look_for_file)
+
+
+# Most common commands and status codes printed per rule
+NUM_TOP = 5
+# Times a param value has to show up in the SQEs of a test to be part of the baseline
+MIN_BASELINE_COUNT = 2
+
+
+@dataclass
+class RuleFailures:
+    '''
+    Failed SQEs of one rule in one or many tests: params and commands (with
+    the passing SQEs of the same commands as baseline) and the SCT/SC of
+    their CQEs.
+    '''
+    similarity: ParamSimilarity
+    status_codes: Counter
+    tests: int = 1
+
+    def merge(self, other: "RuleFailures") -> None:
+        self.similarity.merge_failures(other.similarity)
+        self.status_codes.update(other.status_codes)
+        self.tests += other.tests
+
+
+def load_test_index(test_path: str) -> typing.Optional[CycleIndex]:
+    coverage_path = get_coverage_path(test_path)
+    if not coverage_path or not os.path.isdir(coverage_path):
+        return None
+    dat_files = get_drive_access_tracker_files(coverage_path)
+    if not dat_files:
+        return None
+    return CycleIndex(get_cached_entries(dat_files))
+
+def collect_failures(test_path: str, rules: typing.List[str]) -> typing.Tuple[typing.Dict[str, RuleFailures], dict, dict]:
+    '''
+    One test (worker process), read once: the failed SQEs of every rule, the
+    count_sqe_pairs() of those failed SQEs per rule and of every SQE of the
+    test. The baseline of a rule is the difference, counted by the main
+    process once the failures of every test are known.
+    '''
+    cycle_index = load_test_index(test_path)
+    if cycle_index is None:
+        return {}, {}, {}
+    failures = {}
+    failed_counts = {}
+    for rule in rules:
+        failed_sqes = cycle_index.get_failed_sqe(rule)
+        if not failed_sqes:
+            continue
+        status_codes = Counter()
+        for sqe in failed_sqes:
+            cqe = cycle_index.get_cqe(get_cycle_key(sqe))
+            if cqe is not None:
+                status_codes[(cqe.sct, cqe.sc)] += 1
+        failures[rule] = RuleFailures(ParamSimilarity(failed_sqes), status_codes)
+        failed_counts[rule] = count_sqe_pairs(failed_sqes)
+    if not failures:
+        return {}, {}, {}
+
+    sqe_counts = count_sqe_pairs(cycle.sqe for cycle in cycle_index.cycles.values() if cycle.sqe)
+    # Values seen once (addresses, tags) would make the counts as big as the log, they are
+    # only kept when they failed in this test
+    fail_pairs = set().union(*(rule_failures.similarity.fail_counts for rule_failures in failures.values()))
+    for command, counts in sqe_counts.items():
+        sqe_counts[command] = Counter({pair: count for pair, count in counts.items()
+                                       if count >= MIN_BASELINE_COUNT or pair in fail_pairs or pair[0] == "command"})
+    return failures, failed_counts, sqe_counts
+
+def get_failing_tests(jobs: typing.Iterable[Job], failed_rule_dict: dict,
+                      rules: typing.Optional[typing.List[str]] = None) -> typing.Dict[str, typing.List[str]]:
+    '''
+    failed_rule_dict from Job.get_all_failed_rule_ids() (rule -> (count, links))
+    to test path -> rules failed in that test.
+    '''
+    test_path_by_link = {test.gtax_link: test.test_path for job in jobs for test in job.tests_w_fails}
+    failing_tests = {}
+    for rule, (_, links) in failed_rule_dict.items():
+        if rules and rule not in rules:
+            continue
+        for link in links:
+            test_path = test_path_by_link.get(link)
+            if test_path and rule not in failing_tests.setdefault(test_path, []):
+                failing_tests[test_path].append(rule)
+    return failing_tests
+
+def drilldown(jobs: typing.Iterable[Job], failed_rule_dict: dict, rules: typing.Optional[typing.List[str]] = None,
+              workers: typing.Optional[int] = None) -> typing.Dict[str, RuleFailures]:
+    '''
+    Runs the DAT failed SQE analysis on the coverage logs of every failing
+    test in a process pool and merges it per rule across the job session.
+    '''
+    failing_tests = get_failing_tests(jobs, failed_rule_dict, rules)
+    print(f"Analyzing the DAT files of {len(failing_tests)} failing tests")
+    session: typing.Dict[str, RuleFailures] = {}
+    baselines = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        test_paths = list(failing_tests)
+        for test_path, (failures, failed_counts, sqe_counts) in zip(test_paths, executor.map(collect_failures, test_paths, failing_tests.values())):
+            if not failures:
+                print(f"No DAT failures found in {test_path}")
+            for rule, rule_failures in failures.items():
+                if rule in session:
+                    session[rule].merge(rule_failures)
+                else:
+                    session[rule] = rule_failures
+            baselines.append((failed_counts, sqe_counts))
+
+    # The baseline needs the params of every failure in the session
+    for failed_counts, sqe_counts in baselines:
+        for rule, counts in failed_counts.items():
+            session[rule].similarity.add_baseline_counts(sqe_counts, counts)
+    return session
+
+def print_drilldown(session: typing.Dict[str, RuleFailures], failed_rule_dict: dict) -> None:
+    for rule, rule_failures in sorted(session.items(), key=lambda item: item[1].similarity.total_fails, reverse=True):
+        similarity = rule_failures.similarity
+        total_fails = similarity.total_fails
+        print("====================================================================")
+        print(f"Rule {rule}: failed in {failed_rule_dict[rule][0]} tests, {rule_failures.tests} with DAT files, "
+              f"{total_fails} failed SQEs")
+        print("\n- Commands:")
+        for command, count in similarity.fails_by_command.most_common(NUM_TOP):
+            print(f"{command:<30} {count / total_fails:7.1%} ({count}/{total_fails})")
+        status_total = sum(rule_failures.status_codes.values())
+        print("\n- Status codes of the failed commands:")
+        for (sct, sc), count in rule_failures.status_codes.most_common(NUM_TOP):
+            print(f"{f'SCT={sct} SC={sc}':<30} {count / status_total:7.1%} ({count}/{status_total})")
+        print_param_support(similarity.rank(min_support=MIN_SUPPORT, top=NUM_INCIDENTS), total_fails)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl a GTAX job range and analyze the DAT files of every failing test per rule")
+    parser.add_argument("job_range", nargs="?", help="Ex. 51800-51767 or 51767, asked when not given")
+    parser.add_argument("-r", "--rules", nargs="+", default=None,
+                        help="only these rules instead of every failed rule")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="tests analyzed at the same time, 0 uses every core")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(gtax_rcv_dat_logs_path):
+        print("\t * Need to mount //elements.local/PV/RCV_Logs")
+        print("Exit ...")
+        return
+    id_range = args.job_range or ask_job_id_range()
+    if not re.match(RANGE_FORMAT, id_range):
+        print("Wrong range, not valid format")
+        return
+
+    manifest = CrawlManifest()
+    jobs = get_test_ids_by_job_id(get_job_ids_by_id_range(id_range), manifest=manifest)
+    if not jobs:
+        print(f"\nUnable to get any test, early exit")
+        return
+    look_for_file(jobs, manifest=manifest)
+
+    failed_rule_dict = {}
+    for job in jobs:
+        job.get_all_failed_rule_ids(failed_rule_dict)
+    if not failed_rule_dict:
+        print("\n\tNo rule failed in these jobs")
+        return
+
+    session = drilldown(jobs, failed_rule_dict, args.rules, args.jobs or None)
+    print_drilldown(session, failed_rule_dict)
+    print("\nFinished! ")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,19 @@
 import re
 import typing
 import os
-import subprocess
+import itertools
 import json
+import time
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 mounted = "/root/Y"
-gtax_rcv_dat_logs_path = f"{mounted}/rcv_dat_logs/automated/STAX_Guadalajara_QA"
+gtax_instances = {
+    "QA": f"{mounted}/rcv_dat_logs/automated/STAX_Guadalajara_QA",
+    "UTF": f"{mounted}/rcv_dat_logs/automated/STAX_Guadalajara_UTF",
+}
+gtax_rcv_dat_logs_path = gtax_instances["QA"]
 gtax_test_link = "http://stax-mzm-qa.elements.local/#/jobs/{job_id}#task_tests_{test_id}"
 jobset_sessions_link = "http://stax-mzm-qa.elements.local/#/jobset_sessions/{job_session}?tab=jobs"
 test_plan_id = None
@@ -19,7 +25,89 @@ RANGE_FORMAT = "\d+\-?\d*"
 EXCEPTIONS_FILE_NAME = 'exceptions.log'
 RESULTS_FILE_NAME = 'results.log'
 TEST_JSON_DATA = 'test_env_data.json'
-CMD_SUCCED = 0
+# Same words "grep -w Fail:" / "grep -w Ignore:" looked for in results.log
+FAIL_SECTION_PATTERN = re.compile(r'(?<!\w)Fail:(?!\w)')
+IGNORE_SECTION_PATTERN = re.compile(r'(?<!\w)Ignore:(?!\w)')
+RULE_ID_PATTERN = re.compile(RULE_ID_REGEX)
+TAIL_LINES = 4
+# Tests checked at the same time, the crawl mostly waits on the mounted share
+CRAWL_WORKERS = int(os.environ.get("GTAX_CRAWL_WORKERS", 16))
+PROGRESS_BAR_WIDTH = 50
+# Results of the tests already crawled, GTAX_MANIFEST="" crawls everything again
+GTAX_MANIFEST_PATH = os.environ.get("GTAX_MANIFEST", os.path.join(os.path.expanduser("~"), ".cache", "gtax_crawl_manifest.json"))
+MANIFEST_VERSION = 3
+# Jobs and tests not crawled again for this many days are dropped when the manifest is saved, 0 keeps them all
+GTAX_MANIFEST_MAX_AGE_DAYS = float(os.environ.get("GTAX_MANIFEST_MAX_AGE_DAYS", 30))
+# Files of a test whose size and mtime tell if the test changed since the last crawl
+TEST_FILE_NAMES = (TEST_JSON_DATA, EXCEPTIONS_FILE_NAME, RESULTS_FILE_NAME)
+READ_BLOCK_SIZE = 64 * 1024
+# Drive SN directory of a test and the DAT files inside it
+DRIVE_SN_PATTERN = re.compile('[A-Z0-9]$')
+COVERAGE_DIR = 'content_components/coverage'
+FAILING_SEEDS_TEXT = 'Failing Batch Seed Numbers :'
+SEED_PATTERN = re.compile('[0-9]{2}[0-9a-z]{6}')
+
+
+def get_drive_sn(test_path: str) -> typing.Optional[str]:
+    '''
+    Directory of the test named after the drive SN (ends with [A-Z0-9]).
+    '''
+    try:
+        with os.scandir(test_path) as it:
+            sns = sorted(entry.name for entry in it if entry.is_dir() and DRIVE_SN_PATTERN.search(entry.name))
+    except OSError:
+        return None
+    return sns[0] if sns else None
+
+def get_coverage_path(test_path: str) -> typing.Optional[str]:
+    '''
+    {test_path}/{drive sn}/content_components/coverage, where the DAT files are.
+    '''
+    sn = get_drive_sn(test_path)
+    if not sn:
+        return None
+    return f"{test_path}/{sn}/{COVERAGE_DIR}"
+
+def get_failing_batch_seeds(results_path: str) -> typing.List[str]:
+    '''
+    Seeds in the "Failing Batch Seed Numbers :" lines of results.log, upper
+    case like the end of the DAT file names.
+    '''
+    seeds = []
+    try:
+        with open(results_path, errors="replace") as f:
+            for line in f:
+                if FAILING_SEEDS_TEXT in line:
+                    seeds += [seed.upper() for seed in SEED_PATTERN.findall(line)]
+    except OSError:
+        pass
+    return seeds
+
+
+def read_lines_backward(path: str, block_size: int = READ_BLOCK_SIZE) -> typing.Iterator[str]:
+    '''
+    Lines of a file from the last one to the first (like tac), reads blocks
+    from the end so the beginning of a big file is only read if needed.
+    '''
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = None
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size)
+            if remainder is None:
+                # The newline at the end of the file does not start an empty line
+                if block.endswith(b"\n"):
+                    block = block[:-1]
+                remainder = b""
+            lines = (block + remainder).split(b"\n")
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                yield line.decode(errors="replace")
+        if remainder is not None:
+            yield remainder.decode(errors="replace")
 
 class TestwFile:
     def __init__(self, test_id, job_id) -> None:
@@ -31,6 +119,22 @@ class TestwFile:
         self.file_tail = None        
         self.gtax_link =  self.__get_gtax_test_link()
         self.failed_rule_ids = []
+        self.test_plan_id = None
+
+    def get_record(self, has_exception: bool, has_fails: bool) -> dict:
+        return {"name": self.name, "sut": self.sut, "test_plan_id": self.test_plan_id, "file_tail": self.file_tail,
+                "failed_rule_ids": self.failed_rule_ids, "has_exception": has_exception, "has_fails": has_fails}
+
+    def load_record(self, record: dict) -> typing.Tuple[bool, bool]:
+        global test_plan_id
+        self.name = record["name"]
+        self.sut = record["sut"]
+        self.test_plan_id = record["test_plan_id"]
+        self.file_tail = record["file_tail"]
+        self.failed_rule_ids = record["failed_rule_ids"]
+        if not test_plan_id and self.test_plan_id:
+            test_plan_id = self.test_plan_id
+        return record["has_exception"], record["has_fails"]
 
     def __get_gtax_test_link(self) -> None:
         test_id = self.id.replace("/", "")
@@ -39,14 +143,14 @@ class TestwFile:
     def get_test_name(self):
         global test_plan_id
         test_json_data_path = f"{self.test_path}/{TEST_JSON_DATA}"
-        if not os.path.isfile(f"{test_json_data_path}"):
+        try:
+            with open(test_json_data_path) as f:
+                json_info = json.load(f)
+        except (OSError, ValueError):
             return
-        std_err, std_out = subprocess.getstatusoutput(f'cat {test_json_data_path}')
-        if std_err != CMD_SUCCED:
-            return
-        json_info = json.loads(std_out)
         test_name = json_info['test_name']
         test_sut = json_info['name']
+        self.test_plan_id = json_info['test_plan_id']
         if not test_plan_id:
             test_plan_id = json_info['test_plan_id']
         self.name = test_name
@@ -54,33 +158,124 @@ class TestwFile:
 
     def get_file_tail(self):
         exceptions_path = f"{self.test_path}/{EXCEPTIONS_FILE_NAME}"
-        std_err, std_out = subprocess.getstatusoutput(f'tail -n 4 {exceptions_path}')
-        if std_err != CMD_SUCCED:
+        try:
+            lines = list(itertools.islice(read_lines_backward(exceptions_path), TAIL_LINES))
+        except OSError:
             return
-        strip_std_out = std_out.strip()
-        self.file_tail = strip_std_out
+        self.file_tail = "\n".join(reversed(lines)).strip()
 
     def get_fail_test_ids(self):
+        '''
+        Rule ids at the start of the lines of the last "Fail:" section of
+        results.log, the section ends at the last "Ignore:" line if any.
+        One backward scan, stops as soon as both lines were found.
+        '''
         results_path = f"{self.test_path}/{RESULTS_FILE_NAME}"
-        fail_line_err, fail_line = subprocess.getstatusoutput(f'tac {results_path} | grep -wnm 1 Fail: | cut -d":" -f 1')
-        if fail_line_err != CMD_SUCCED or fail_line == '':
+        # Lines from the end of the file up to the Fail: line, newest first
+        fail_section = []
+        fail_line = ignore_line = None
+        try:
+            for line_number, line in enumerate(read_lines_backward(results_path), start=1):
+                if fail_line is None:
+                    fail_section.append(line)
+                    if FAIL_SECTION_PATTERN.search(line):
+                        fail_line = line_number
+                if ignore_line is None and IGNORE_SECTION_PATTERN.search(line):
+                    ignore_line = line_number
+                if fail_line is not None and ignore_line is not None:
+                    break
+        except OSError:
+            return
+        if fail_line is None:
             return
-        ignore_line_err, ignore_line = subprocess.getstatusoutput(f'tac {results_path} | grep -wnm 1 Ignore: | cut -d":" -f 1')
-        if ignore_line_err == CMD_SUCCED and ignore_line != '':
-            # stringa = f'sed -n {fail_line},{ignore_line}p {results_path}'
-            ignore_line = int(fail_line) - int(ignore_line)
-            stringa = f'tail -n {fail_line} {results_path} | head -n {ignore_line}'
-        else:
-            # stringa = f'sed \'1,{fail_line}d\' {results_path}' # sed -n 229,203p results.log | grep -Eo '^[A-Z]{4}\_[0-9|A-Z]{4}'
-            stringa = f'tail -n {fail_line} {results_path}'
-        failed_rule_ids_err, failed_rule_ids = subprocess.getstatusoutput(f'{stringa} | grep -Eo \'{RULE_ID_REGEX}\'')
-
-        if failed_rule_ids_err == CMD_SUCCED and failed_rule_ids != '':
-            failed_rule_ids = failed_rule_ids.split("\n")
+        fail_section.reverse()
+        if ignore_line is not None:
+            # Same as "head -n (fail_line - ignore_line)", negative drops lines from the end
+            fail_section = fail_section[:fail_line - ignore_line]
+        failed_rule_ids = [match.group() for match in map(RULE_ID_PATTERN.match, fail_section) if match]
+
+        if failed_rule_ids:
             self.failed_rule_ids = failed_rule_ids
             return True
         return False
 
+class CrawlManifest:
+    '''
+    Local JSON file with the results of every test crawled before, keyed by
+    the test path and the sizes and mtimes of its files, and the test ids of every job
+    keyed by the job directory mtime. A re-run over an overlapping range only
+    reads the jobs and tests that are new or changed. Every record keeps when
+    it was last crawled ("seen"), save() drops the ones older than max_age_days.
+    '''
+    def __init__(self, path: typing.Optional[str] = GTAX_MANIFEST_PATH,
+                 max_age_days: float = GTAX_MANIFEST_MAX_AGE_DAYS) -> None:
+        self.path = path
+        self.max_age_days = max_age_days
+        self.now = int(time.time())
+        self.jobs = {}
+        self.tests = {}
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Unable to read the crawl manifest {path}: {e}")
+            return
+        if manifest.get("version") == MANIFEST_VERSION:
+            self.jobs = manifest["jobs"]
+            self.tests = manifest["tests"]
+
+    def get_test_ids(self, job_path: str, mtime_ns: int) -> typing.Optional[list]:
+        job = self.jobs.get(job_path)
+        if job and job["mtime_ns"] == mtime_ns:
+            job["seen"] = self.now
+            return job["test_ids"]
+        return None
+
+    def set_test_ids(self, job_path: str, mtime_ns: int, test_ids: list) -> None:
+        self.jobs[job_path] = {"mtime_ns": mtime_ns, "test_ids": test_ids, "seen": self.now}
+
+    def get_test(self, test_path: str, test_files: dict) -> typing.Optional[dict]:
+        test = self.tests.get(test_path)
+        if test and test["files"] == test_files:
+            test["seen"] = self.now
+            return test["record"]
+        return None
+
+    def set_test(self, test_path: str, test_files: dict, record: dict) -> None:
+        self.tests[test_path] = {"files": test_files, "record": record, "seen": self.now}
+
+    def prune(self) -> int:
+        '''
+        Drops the jobs and tests not crawled in the last max_age_days, returns how many.
+        '''
+        if not self.max_age_days:
+            return 0
+        oldest = self.now - self.max_age_days * 24 * 60 * 60
+        pruned = 0
+        for records in (self.jobs, self.tests):
+            for key in [key for key, record in records.items() if record["seen"] < oldest]:
+                del records[key]
+                pruned += 1
+        return pruned
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        pruned = self.prune()
+        if pruned:
+            print(f"{pruned} jobs and tests not crawled in {self.max_age_days:g} days dropped from the crawl manifest")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "jobs": self.jobs, "tests": self.tests}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Unable to write the crawl manifest {self.path}: {e}")
+
+
 class Job:
     def __init__(self, id) -> None:
         self.id = id
@@ -145,43 +340,121 @@ def get_job_ids_by_id_range(id_range:str) -> typing.Iterable:
     else:
         return int_ranges
 
-def get_test_ids_by_job_id(job_ids: typing.Iterable) -> list:
-    jobs = []
+def get_test_ids(job_id, manifest: typing.Optional[CrawlManifest] = None) -> typing.Optional[Job]:
+    job_id_path = f"{gtax_rcv_dat_logs_path}/{job_id}"
+    try:
+        mtime_ns = os.stat(job_id_path).st_mtime_ns
+    except OSError:
+        print(f"Unable to get: {job_id_path}")
+        return None
+    # The job directory mtime changes when a test directory is added
+    test_ids = manifest.get_test_ids(job_id_path, mtime_ns) if manifest else None
+    if test_ids is None:
+        try:
+            # One listing, the entry type comes with it
+            with os.scandir(job_id_path) as it:
+                test_ids = sorted(entry.name for entry in it if entry.is_dir())
+        except OSError:
+            return None
+        if manifest:
+            manifest.set_test_ids(job_id_path, mtime_ns, test_ids)
+    job_instance = Job(job_id)
+    job_instance.test_ids = test_ids
+    return job_instance
+
+def get_test_ids_by_job_id(job_ids: typing.Iterable, workers: int = CRAWL_WORKERS,
+                           manifest: typing.Optional[CrawlManifest] = None) -> list:
     print("\nGetting tests id for every job")
-    for job_id in job_ids:
-        job_id_path = f"{gtax_rcv_dat_logs_path}/{job_id}" 
-        if not os.path.isdir(gtax_rcv_dat_logs_path):
-            print(f"Unable to get: {job_id_path}")
-            continue
-        std_err, std_out = subprocess.getstatusoutput(f'ls {job_id_path}')
-        if std_err == CMD_SUCCED:
-            test_ids = std_out.split("\n")
-            job_instance = Job(job_id)
-            job_instance.test_ids = test_ids
-            jobs.append(job_instance)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() keeps the job order
+        jobs = [job for job in executor.map(lambda job_id: get_test_ids(job_id, manifest), job_ids) if job is not None]
     return jobs
 
-def look_for_file(jobs) -> None:
-    print(f"Total jobs to check: {len(jobs)}")
-
-    for number, job in enumerate(jobs, start=1):
-        print(f"- Job {job.id} ({number}): ")
-        tests = job.test_ids
-        total_test = len(tests)
-        for test_num, test_id in enumerate(tests, start=1):
-            arrows = "=" * test_num
-            print(f"{arrows}> {test_num}/{total_test} tests", end="\r")
-            test_id_path = f"{gtax_rcv_dat_logs_path}/{job.id}/{test_id}"
-            test_instance = TestwFile(test_id, job.id)
-            test_instance.test_path = test_id_path
-            if os.path.isfile(f"{test_id_path}/{EXCEPTIONS_FILE_NAME}"):                                    
-                test_instance.get_test_name()
-                test_instance.get_file_tail()
+def scan_test_files(test_path: str) -> dict:
+    '''
+    [size, mtime] of every file in TEST_FILE_NAMES from a single listing of
+    the test directory, None when the file does not exist.
+    '''
+    test_files = dict.fromkeys(TEST_FILE_NAMES)
+    try:
+        with os.scandir(test_path) as it:
+            for entry in it:
+                if entry.name in test_files and entry.is_file():
+                    stat = entry.stat()
+                    test_files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        pass
+    return test_files
+
+def check_test(job_id, test_id, manifest: typing.Optional[CrawlManifest] = None) -> typing.Tuple[TestwFile, bool, bool, dict, bool]:
+    '''
+    Reads the files of one test, or takes its results from the manifest when
+    none of them changed. Returns it with (has exceptions, has fails, test files, read).
+    '''
+    test_id_path = f"{gtax_rcv_dat_logs_path}/{job_id}/{test_id}"
+    test_instance = TestwFile(test_id, job_id)
+    test_instance.test_path = test_id_path
+    test_files = scan_test_files(test_id_path)
+    record = manifest.get_test(test_id_path, test_files) if manifest else None
+    if record is not None:
+        has_exception, has_fails = test_instance.load_record(record)
+        return test_instance, has_exception, has_fails, test_files, False
+
+    has_exception = has_fails = False
+    if test_files[EXCEPTIONS_FILE_NAME] is not None:
+        if test_files[TEST_JSON_DATA] is not None:
+            test_instance.get_test_name()
+        # An empty exceptions.log has no tail to read
+        if test_files[EXCEPTIONS_FILE_NAME][0]:
+            test_instance.get_file_tail()
+        has_exception = True
+    if test_files[RESULTS_FILE_NAME] is not None and test_files[RESULTS_FILE_NAME][0]:
+        has_fails = bool(test_instance.get_fail_test_ids())
+    return test_instance, has_exception, has_fails, test_files, True
+
+def print_progress(done: int, total: int, jobs_done: int, total_jobs: int) -> None:
+    arrows = "=" * (PROGRESS_BAR_WIDTH * done // total)
+    print(f"{arrows}> {done}/{total} tests, {jobs_done}/{total_jobs} jobs", end="\r")
+
+def look_for_file(jobs, workers: int = CRAWL_WORKERS, manifest: typing.Optional[CrawlManifest] = None) -> None:
+    '''
+    Checks the tests of every job in a thread pool of workers threads,
+    the tests are added to their job in the listing order once all are done.
+    '''
+    total_test = sum(len(job.test_ids) for job in jobs)
+    print(f"Total jobs to check: {len(jobs)} ({total_test} tests, {workers} at a time)")
+    if not total_test:
+        return
+
+    results = {job.id: [None] * len(job.test_ids) for job in jobs}
+    pending_by_job = {job.id: len(job.test_ids) for job in jobs}
+    jobs_done = sum(1 for pending in pending_by_job.values() if not pending)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(check_test, job.id, test_id, manifest): (job.id, position)
+                   for job in jobs for position, test_id in enumerate(job.test_ids)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            job_id, position = futures[future]
+            results[job_id][position] = future.result()
+            pending_by_job[job_id] -= 1
+            if not pending_by_job[job_id]:
+                jobs_done += 1
+            print_progress(done, total_test, jobs_done, len(jobs))
+    print("\n")
+
+    tests_read = 0
+    for job in jobs:
+        for test_instance, has_exception, has_fails, test_files, read in results[job.id]:
+            if has_exception:
                 job.add_test_w_exception(test_instance)
-            if os.path.isfile(f"{test_id_path}/{RESULTS_FILE_NAME}"):
-                if test_instance.get_fail_test_ids():
-                    job.add_test_w_fails(test_instance)
-        print("\n")
+            if has_fails:
+                job.add_test_w_fails(test_instance)
+            if read:
+                tests_read += 1
+                if manifest:
+                    manifest.set_test(test_instance.test_path, test_files, test_instance.get_record(has_exception, has_fails))
+    if manifest:
+        print(f"{tests_read} tests read, {total_test - tests_read} unchanged since the last crawl")
+        manifest.save()
 
 def file_info(file):    
     if info:
@@ -257,11 +530,12 @@ if __name__ == '__main__':
     # Ex. 25467 (info added in the final file)
     job_session = input("Job session: ")
     job_ids = get_job_ids_by_id_range(id_range)
-    jobs = get_test_ids_by_job_id(job_ids)
+    manifest = CrawlManifest()
+    jobs = get_test_ids_by_job_id(job_ids, manifest=manifest)
     if not jobs:
         print(f"\nUnable to get any test, early exit")
         exit()
-    look_for_file(jobs)
+    look_for_file(jobs, manifest=manifest)
     jobs_w_exceptions = list(filter(lambda job: job.has_tests_w_exceptions, jobs))
     jobs_w_fails = list(filter(lambda job: job.has_tests_w_fails, jobs))
 
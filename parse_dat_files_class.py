@@ -1,100 +1,50 @@
-import re
 import os
-from typing import List, Dict, Optional
-from dataclasses import dataclass
+import time
+import argparse
+from collections import deque
+from typing import List, Dict
+
+from dat_parser import (DATLine, SQE, CQE, RULE_CHECK, LinePrescreen, sqe_pattern, param_pattern,
+                        get_drive_access_tracker_files, get_entries, iter_entries, get_failed_cycle_ids,
+                        CycleKey, get_cycle_key)
+from dat_index import CycleIndex, SQETimeline
+from dat_cache import get_cached_entries
+from dat_follow import DATFollower
+from dat_stats import ParamSimilarity, ParamSupport, FailureSequenceMiner
+from dat_export import export_entries
 
 
 NUM_FAILED_SQE = 5
 NUM_SQE_BEFORE = 3
+# Attributes of the failed SQEs: show the pairs in at least MIN_SUPPORT of the failures, up to NUM_INCIDENTS
+MIN_SUPPORT = 0.5
+NUM_INCIDENTS = 10
+NUM_SEQUENCES = 10
 OMIT_DIR = [".vscode"]
 
-@dataclass
-class DATLine:
-    timestamp: Optional[str] = None
-    pid: Optional[str] = None
-    rid: Optional[str] = None
-    cycle_id: Optional[str] = None
-    time_ms: Optional[str] = None
-    direction: Optional[str] = None
-    result: Optional[str] = None
-    number: Optional[str] = None
-    rule: Optional[str] = None
-    details: Optional[str] = None
-    filename: Optional[str] = None
-    sc: Optional[str] = None
-    sct: Optional[str] = None
-
-dat_pattern = re.compile(
-    r'^(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+)\s+'
-    r'(?P<pid>\S+)\s+(?P<rid>\S+)\s+(?P<cycle_id>\S+)\s*'
-    r'(?P<time_ms>\d*\.\d+)?\s*'
-    r'(?P<direction>(==>|<==|===))\s*'
-    r'(?P<result>(Fail|Pass))?\s*'
-    r'(?P<number>#\d+\s+)?\s*'
-    r'(?P<rule>([A-Z0-9_]+))?'
-    r'(?P<details>.*)$'
-)
-
-sqe_pattern = re.compile(
-    r'^(?P<command>\w+)\('
-    r'(?P<params>[^)]+)\)'
-)
-
-param_pattern = re.compile(
-    r'(\w+)=(0x[0-9a-fA-F]+|\d+|\w+)'
-)
-
-def populate_its_status(dat_entries: List[DATLine], sorted_previous_sqe_n: List[DATLine]):
+def populate_its_status(cycle_index: CycleIndex, sorted_previous_sqe_n: List[DATLine]):
     for previous_sqe in sorted_previous_sqe_n:
-        cycle_id = previous_sqe.cycle_id
-        cqe = filter(lambda dat_line: dat_line.cycle_id == cycle_id and dat_line.direction == "<==", dat_entries)
-        if not cqe:
+        cqe = cycle_index.get_cqe(get_cycle_key(previous_sqe))
+        if cqe is None:
             continue
-        cqe = next(cqe, None)
-        if not isinstance(cqe, DATLine):
-            return
         details = cqe.details
         param_matches = param_pattern.findall(details)
         param_dict = {m[0]: m[1] for m in param_matches}
         previous_sqe.sc = param_dict.get("SC", None)
         previous_sqe.sct = param_dict.get("SCT", None)
 
-# Function to get all drive_access_tracker* files from a directory
-def get_drive_access_tracker_files(directory):
-    try:
-        dat_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.startswith('drive_access_tracker')]
-        return dat_files
-    except FileNotFoundError:
-        print("Exit: That directory was not found")
-
-def get_entries(logfiles):
-    dat_entries = []
-    for logfile in logfiles:
-        with open(logfile) as f:
-            for line in f:
-                match = dat_pattern.match(line)
-                if match:
-                    entry = match.groupdict()
-                    entry['filename'] = os.path.basename(logfile)
-                    new_dat_line = DATLine(**entry)
-                    dat_entries.append(new_dat_line)
-    return dat_entries
-
 def get_sqe_details(failed_sqe: List[Dict[str, str]]):
     if not failed_sqe:
         return
     failed_sqe_details = [dat_line.details for dat_line in failed_sqe]
     return failed_sqe_details
 
-def get_sqe_by_failed_rule(dat_entries: List[Dict[str, str]], rule: str, how_many_sqe:int = 5):
+def get_sqe_by_failed_rule(cycle_index: CycleIndex, rule: str, how_many_sqe:int = 5):
     if not rule:
         print("No rule provided")
         return
 
-    failed_rule = list(filter(lambda dat_line: dat_line.rule == rule and dat_line.result == "Fail", dat_entries))
-    failed_cycle_ids = [dat_line.cycle_id for dat_line in failed_rule]
-    failed_sqe = list(filter(lambda dat_line: dat_line.cycle_id in failed_cycle_ids and dat_line.direction == "==>", dat_entries))
-    return failed_sqe[:how_many_sqe]
+    return cycle_index.get_failed_sqe(rule, how_many_sqe)
 
 def divide_sqe(sqe: str):
     param_dict = {}
@@ -129,6 +79,20 @@ def get_sqe_similarities(parsed_sqe: List[str] = []):
     incidents: Dict[str, str] = find_incidents(parsed_sqe)
     return incidents
 
+def get_param_similarity(cycle_index: CycleIndex, rule: str) -> ParamSimilarity:
+    '''
+    Uses every failed SQE of the rule, not only the NUM_FAILED_SQE printed.
+    '''
+    similarity = ParamSimilarity(cycle_index.get_failed_sqe(rule))
+    similarity.add_baseline(cycle.sqe for cycle in cycle_index.cycles.values() if cycle.sqe)
+    return similarity
+
+def print_param_support(param_support: List[ParamSupport], total_fails: int):
+    print(f"\n- Incidents, attributes repeated in the {total_fails} failed SQEs (support, passing SQEs of the same command, lift):")
+    for item in param_support:
+        pair = f"{item.param}={item.value}"
+        print(f"{pair:<30} {item.support:7.1%} ({item.fail_count}/{total_fails})\t{item.baseline:7.1%}\tlift {item.lift:.2f}")
+
 def printr(Message, items):
     print(f"\n{Message}:")
     if isinstance(items, list):
@@ -143,20 +107,183 @@ def get_failed_commands(parsed_sqe):
     commands = set([entry["command"] for entry in parsed_sqe])
     return commands
 
-def get_sqe_before_failed_sqe_pair(dat_entries: List[DATLine], failed_sqe_by_rule, how_many_before=1):
+def get_sqe_before_failed_sqe_pair(sqe_timeline: SQETimeline, cycle_index: CycleIndex, failed_sqe_by_rule, how_many_before=1):
     pair_sqe_previous_failed = []
     for dat_line in failed_sqe_by_rule:
-        failed_sqe_timestamp = dat_line.timestamp
-        previous_sqe = list(filter(lambda dat_line: dat_line.timestamp < failed_sqe_timestamp and dat_line.direction == "==>", dat_entries))
-        if not previous_sqe:
+        sorted_previous_sqe_n = sqe_timeline.get_previous(dat_line, how_many_before)
+        if not sorted_previous_sqe_n:
             continue
-        sorted_previous_sqe = sorted(previous_sqe, key=lambda dat_line: dat_line.timestamp, reverse=True)
-        sorted_previous_sqe_n = sorted_previous_sqe[:how_many_before]
-        populate_its_status(dat_entries, [dat_line])
-        populate_its_status(dat_entries, sorted_previous_sqe_n)
+        populate_its_status(cycle_index, [dat_line])
+        populate_its_status(cycle_index, sorted_previous_sqe_n)
         pair_sqe_previous_failed.append({"failed_command": dat_line, "previous_commands": sorted_previous_sqe_n})
     return pair_sqe_previous_failed
 
+def stream_failed_sqe_pairs(logfiles: List[str], rule: str, how_many_sqe: int = 5, how_many_before: int = 1):
+    '''
+    Streaming version of get_sqe_by_failed_rule() + get_sqe_before_failed_sqe_pair().
+    First pass keeps only the failed cycle ids of the rule, second pass walks the
+    timestamp ordered stream keeping just the last how_many_before SQEs.
+    '''
+    rule_prescreen = LinePrescreen(directions=[RULE_CHECK], rules=[rule])
+    failed_cycle_ids = get_failed_cycle_ids(iter_entries(logfiles, prescreen=rule_prescreen), rule)
+    if not failed_cycle_ids:
+        return []
+
+    pair_sqe_previous_failed = []
+    previous_sqe = deque(maxlen=how_many_before)
+    # SQEs already reported whose CQE has not been seen yet
+    waiting_cqe: Dict[CycleKey, List[DATLine]] = {}
+    for dat_line in iter_entries(logfiles, ordered=True, prescreen=LinePrescreen(directions=[SQE, CQE])):
+        key = get_cycle_key(dat_line)
+        if dat_line.direction == CQE:
+            waiting = waiting_cqe.pop(key, [])
+            waiting.extend(sqe for sqe in previous_sqe if get_cycle_key(sqe) == key)
+            if waiting:
+                dat_line.populate_CQE_attr()
+                for sqe in waiting:
+                    sqe.sc, sqe.sct = dat_line.sc, dat_line.sct
+            if len(pair_sqe_previous_failed) == how_many_sqe and not waiting_cqe:
+                break
+            continue
+        if dat_line.direction != SQE:
+            continue
+        if key in failed_cycle_ids and len(pair_sqe_previous_failed) < how_many_sqe:
+            previous_sqe_n = [sqe for sqe in reversed(previous_sqe) if sqe.ts_ns < dat_line.ts_ns]
+            pair_sqe_previous_failed.append({"failed_command": dat_line, "previous_commands": previous_sqe_n})
+            for sqe in [dat_line] + previous_sqe_n:
+                if sqe.sc is None:
+                    waiting_cqe.setdefault(get_cycle_key(sqe), []).append(sqe)
+        previous_sqe.append(dat_line)
+    return pair_sqe_previous_failed
+
+def print_failed_sqe_pairs(failed_sqe_pairs: List[Dict[str, DATLine]]):
+    print(f"\n- Previous {NUM_SQE_BEFORE} command(s) to the failing SQE")
+    for num, previous_commands in enumerate(failed_sqe_pairs):
+        failed_sqe: DATLine = previous_commands["failed_command"]
+        print(f"\nFailed {num + 1}:\t\t{failed_sqe.filename}\t\t{failed_sqe.cycle_id}")            
+        status_codes_to_print = " "
+        if failed_sqe.sct and failed_sqe.sc:
+            status_codes_to_print = f" (SCT: {failed_sqe.sct}, SC: {failed_sqe.sc}) "   
+        print(f"{failed_sqe.timestamp} -{status_codes_to_print}{failed_sqe.details}\n")
+        for num, previous_command in enumerate(previous_commands["previous_commands"]):
+            status_codes_to_print = " "
+            if previous_command.sct and previous_command.sc:
+                status_codes_to_print = f" (SCT: {previous_command.sct}, SC: {previous_command.sc}) "                
+            print(f"{previous_command.timestamp} - {num + 1}){status_codes_to_print}{previous_command.details}")
+
+def report_rule(failed_sqe_by_rule: List[DATLine], failed_sqe_pairs: List[Dict[str, DATLine]], cycle_index: CycleIndex = None, rule: str = None,
+                similarity: ParamSimilarity = None):
+    # ----- Print failed SQE command --------
+    failed_sqe_details: List[str] = get_sqe_details(failed_sqe_by_rule)
+    printr(f"Failed SQE, limit({NUM_FAILED_SQE})", failed_sqe_details)
+
+    # ----- Print How many commands and which commands failed --------
+    parsed_failed_sqes = parse_sqe_details(failed_sqe_details)
+
+    commands = get_failed_commands(parsed_failed_sqes)
+    print(f"\n*{len(commands)} command(s) failed with the same rule, {commands}")
+
+    # ----- Print attributes in common in the failed commands --------
+    if similarity is None and cycle_index is not None and rule:
+        # Support is over the failed SQEs found, a failed cycle can have no SQE logged
+        similarity = get_param_similarity(cycle_index, rule)
+    if similarity is not None:
+        print_param_support(similarity.rank(min_support=MIN_SUPPORT, top=NUM_INCIDENTS), similarity.total_fails)
+    else:
+        # Streaming mode only keeps the printed failures
+        similarities_insight: Dict[str, str] = get_sqe_similarities(parsed_failed_sqes)
+        printr("- Incidents, attributes repeated in failed SQEs", similarities_insight)
+
+    # ----- Print n SQE that happend before the failed SQE command --------
+    print_failed_sqe_pairs(failed_sqe_pairs)
+
+def report_failed_rule(cycle_index: CycleIndex, sqe_timeline: SQETimeline, rule: str) -> bool:
+    failed_sqe_by_rule: List[DATLine] = get_sqe_by_failed_rule(cycle_index, rule, how_many_sqe=NUM_FAILED_SQE)
+    if not failed_sqe_by_rule:
+        print("\n No failures with this rule were detected")
+        return False
+
+    failed_sqe_pairs: List[Dict[str, DATLine]] = get_sqe_before_failed_sqe_pair(sqe_timeline, cycle_index, failed_sqe_by_rule, how_many_before=NUM_SQE_BEFORE)
+    report_rule(failed_sqe_by_rule, failed_sqe_pairs, cycle_index, rule)
+    return True
+
+def load_entries(dat_files: List[str], jobs: int = 1, no_cache: bool = False) -> List[DATLine]:
+    if no_cache:
+        return get_entries(dat_files, jobs=jobs or None)
+    return get_cached_entries(dat_files, jobs=jobs or None)
+
+def run_batch(directories: List[str], rules: List[str], all_failing: bool = False, jobs: int = 1,
+              no_cache: bool = False, context_by=None):
+    '''
+    Non interactive mode, every directory is parsed and indexed once and
+    the report of every rule (or every rule that failed) comes from that index.
+    '''
+    for directory in directories:
+        print("====================================================================")
+        dat_files: List[str] = get_drive_access_tracker_files(directory)
+        if not dat_files:
+            print(f"{directory}: no DAT files")
+            continue
+
+        dat_entries = load_entries(dat_files, jobs, no_cache)
+        cycle_index = CycleIndex(dat_entries)
+        sqe_timeline = SQETimeline(dat_entries, group_by=context_by)
+        directory_rules = list(rules)
+        if all_failing:
+            failing_rules = sorted(cycle_index.failing_rules, key=lambda rule: len(cycle_index.failed_cycle_ids[rule]), reverse=True)
+            directory_rules += [rule for rule in failing_rules if rule not in directory_rules]
+        print(f"{directory}: {len(dat_files)} DAT files, {len(directory_rules)} rule(s) to check")
+
+        for rule in directory_rules:
+            print("--------------------------------------------------------------------")
+            print(f"Rule {rule}: {len(cycle_index.get_failed_cycle_ids(rule))} fail(s)")
+            report_failed_rule(cycle_index, sqe_timeline, rule)
+
+def mine_sequences(dat_files: List[str], rules: List[str], n: int = 3, bucket_param=None, context_by=None):
+    '''
+    Ranks the n commands sequences that come right before the fails of every
+    rule (or of every failing rule when rules is empty) against how often they
+    show up before any SQE. Single streaming pass over the timestamp ordered files.
+    '''
+    miner = FailureSequenceMiner(n, bucket_param, rules, context_by)
+    for dat_line in iter_entries(dat_files, ordered=True, prescreen=LinePrescreen(directions=[SQE, RULE_CHECK])):
+        miner.add(dat_line)
+
+    for rule in rules or miner.failing_rules:
+        print("--------------------------------------------------------------------")
+        print(f"Rule {rule}: {miner.total_fails[rule]} fail(s), {n} command(s) before the failing SQE "
+              f"(times before a fail, fail rate, baseline rate, ratio)")
+        for score in miner.rank(rule, top=NUM_SEQUENCES):
+            sequence = " -> ".join(score.sequence)
+            print(f"{score.ratio:8.2f}x  {score.fail_count:>6}  {score.fail_rate:7.1%}  {score.baseline_rate:7.1%}  {sequence}")
+
+def follow_rule(directory: str, rule: str, context_by=None, interval: float = 2.0):
+    '''
+    Keeps parsing only the lines appended to the DAT files and prints the
+    report again every time a new Fail of the rule shows up.
+    '''
+    follower = DATFollower(directory, context_by)
+    reported_fails = 0
+    print(f"\n*Following DAT files in {directory} for rule \"{rule}\", Ctrl+C to exit")
+    try:
+        while True:
+            follower.poll()
+            failed_cycle_ids = follower.cycle_index.get_failed_cycle_ids(rule)
+            if len(failed_cycle_ids) > reported_fails:
+                reported_fails = len(failed_cycle_ids)
+                print("--------------------------------------------------------------------")
+                print(f"{time.strftime('%H:%M:%S')} - {reported_fails} fail(s) of {rule}, "
+                      f"all rules: {dict(follower.fail_counts.most_common())}")
+                # Last failures are the interesting ones while the test runs
+                failed_sqe_by_rule = [sqe for sqe in map(follower.cycle_index.get_sqe, failed_cycle_ids[-NUM_FAILED_SQE:]) if sqe]
+                failed_sqe_pairs = get_sqe_before_failed_sqe_pair(follower.sqe_timeline, follower.cycle_index, failed_sqe_by_rule, how_many_before=NUM_SQE_BEFORE)
+                if failed_sqe_by_rule:
+                    # Counted while the lines were read, not by going through every cycle again
+                    report_rule(failed_sqe_by_rule, failed_sqe_pairs, similarity=follower.get_param_similarity(rule))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nFinished! ")
+
 def get_directory():
     script_directory = os.path.dirname(os.path.abspath(__file__))
 
@@ -174,58 +301,101 @@ def get_directory():
 
     return directory
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Look for the SQE commands that failed a DAT rule")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the DAT files instead of loading every entry in memory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="parse the DAT files in this many processes, 0 uses every core")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the DAT files again instead of using the parsed entries cache")
+    parser.add_argument("--context-by", choices=["filename", "pid"], default=None,
+                        help="only look for the previous commands in the same DAT file or pid")
+    parser.add_argument("-d", "--directory", nargs="+", default=None,
+                        help="DAT directories to check instead of asking for one")
+    parser.add_argument("-r", "--rules", nargs="+", default=[],
+                        help="rules to report without asking, all of them come from a single parse")
+    parser.add_argument("--all-failing", action="store_true",
+                        help="report every rule with at least one Fail")
+    parser.add_argument("--sequences", type=int, default=0, metavar="N",
+                        help="rank the N commands sequences that come before the fails of the rule(s)")
+    parser.add_argument("--bucket", default=None, metavar="PARAM",
+                        help="with --sequences, split every command by the value of this SQE param")
+    parser.add_argument("--export", default=None, metavar="DB",
+                        help="write the entries, SQE params and SQE/CQE pairs of the DAT files to this SQLite file")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep parsing the new DAT lines and report every new fail of the rule")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between reads in --follow mode")
+    return parser.parse_args()
+
 def main():
-    directory = get_directory()
+    args = parse_args()
+    if args.export:
+        dat_files = []
+        for directory in args.directory or [get_directory()]:
+            dat_files += get_drive_access_tracker_files(directory) or []
+        total = export_entries(dat_files, args.export)
+        print(f"\n{total} entries exported to {args.export}")
+        return
+
+    if args.sequences and (args.rules or args.all_failing):
+        for directory in args.directory or [get_directory()]:
+            print("====================================================================")
+            print(directory)
+            dat_files: List[str] = get_drive_access_tracker_files(directory)
+            if dat_files:
+                mine_sequences(dat_files, args.rules, args.sequences, args.bucket, args.context_by)
+        print("\nFinished! ")
+        return
+
+    if args.rules or args.all_failing:
+        directories = args.directory or [get_directory()]
+        run_batch(directories, args.rules, args.all_failing, args.jobs, args.no_cache, args.context_by)
+        print("\nFinished! ")
+        return
+
+    directory = args.directory[0] if args.directory else get_directory()
     rule = input("Rule: ")
     if rule == '':
         return "No rule provided"
 
+    if args.follow:
+        follow_rule(directory, rule, context_by=args.context_by, interval=args.interval)
+        return
+
+    if args.sequences:
+        dat_files: List[str] = get_drive_access_tracker_files(directory)
+        if dat_files:
+            mine_sequences(dat_files, [rule], args.sequences, args.bucket, args.context_by)
+        return
+
     dat_files: List[str] = get_drive_access_tracker_files(directory)
     if not dat_files:
         return
     print(f"\n*{len(dat_files)} DAT files detected to check for rule \"{rule}\"")
 
-    dat_entries: List[DATLine] = get_entries(dat_files)
-    while rule != '':
+    if args.stream:
         print("--------------------------------------------------------------------")
-        failed_sqe_by_rule: List[DATLine] = get_sqe_by_failed_rule(dat_entries, rule, how_many_sqe=NUM_FAILED_SQE)
-        if not failed_sqe_by_rule:
+        failed_sqe_pairs = stream_failed_sqe_pairs(dat_files, rule, how_many_sqe=NUM_FAILED_SQE, how_many_before=NUM_SQE_BEFORE)
+        if not failed_sqe_pairs:
             print("\n Exit: No failures with this rule were detected")
             return
+        failed_sqe_by_rule = [pair["failed_command"] for pair in failed_sqe_pairs]
+        report_rule(failed_sqe_by_rule, failed_sqe_pairs)
+        print("\nFinished! ")
+        return
 
-        # ----- Print failed SQE command --------
-        failed_sqe_details: List[str] = get_sqe_details(failed_sqe_by_rule)
-        printr(f"Failed SQE, limit({NUM_FAILED_SQE})", failed_sqe_details)
-
-        # ----- Print How many commands and which commands failed --------
-        parsed_failed_sqes = parse_sqe_details(failed_sqe_details)
-
-        commands = get_failed_commands(parsed_failed_sqes)
-        print(f"\n*{len(commands)} command(s) failed with the same rule, {commands}")
-
-        # ----- Print attributes in common in the failed commands --------
-        similarities_insight: Dict[str, str] = get_sqe_similarities(parsed_failed_sqes)
-        printr("- Incidents, attributes repeated in failed SQEs", similarities_insight)
-
-        # ----- Print n SQE that happend before the failed SQE command --------
-        failed_sqe_pairs: List[Dict[str, DATLine]] = get_sqe_before_failed_sqe_pair(dat_entries, failed_sqe_by_rule, how_many_before=NUM_SQE_BEFORE)
-        print(f"\n- Previous {NUM_SQE_BEFORE} command(s) to the failing SQE")
-        for num, previous_commands in enumerate(failed_sqe_pairs):
-            failed_sqe: DATLine = previous_commands["failed_command"]
-            print(f"\nFailed {num + 1}:\t\t{failed_sqe.filename}\t\t{failed_sqe.cycle_id}")            
-            status_codes_to_print = " "
-            if failed_sqe.sct and failed_sqe.sc:
-                status_codes_to_print = f" (SCT: {failed_sqe.sct}, SC: {failed_sqe.sc}) "   
-            print(f"{failed_sqe.timestamp} -{status_codes_to_print}{failed_sqe.details}\n")
-            for num, previous_command in enumerate(previous_commands["previous_commands"]):
-                status_codes_to_print = " "
-                if previous_command.sct and previous_command.sc:
-                    status_codes_to_print = f" (SCT: {previous_command.sct}, SC: {previous_command.sc}) "                
-                print(f"{previous_command.timestamp} - {num + 1}){status_codes_to_print}{previous_command.details}")
+    dat_entries: List[DATLine] = load_entries(dat_files, args.jobs, args.no_cache)
+    cycle_index = CycleIndex(dat_entries)
+    sqe_timeline = SQETimeline(dat_entries, group_by=args.context_by)
+    while rule != '':
+        print("--------------------------------------------------------------------")
+        report_failed_rule(cycle_index, sqe_timeline, rule)
 
+        # Entries and indexes stay loaded, any other rule is answered from memory
         print("\n*Push Enter to exit")
         rule = input("- Any other rule you want to see: ")
-        rule = ''
     else:
         print("\nFinished! ")
 
@@ -0,0 +1,92 @@
+'''
+Checks that an export interrupted in the middle of a file leaves nothing of
+that file in the database and that the next run exports it again.
+Run with: python3 -m unittest test_dat_export
+'''
+import os
+import shutil
+import functools
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import dat_export
+from benchmark import generate_dat_file
+from dat_parser import iter_file_entries
+
+
+FILE_LINES = 3000
+
+
+def interrupted_entries(interrupted_logfile: str, after: int):
+    '''
+    iter_file_entries() that stops with a Ctrl+C after some lines of interrupted_logfile.
+    '''
+    def iter_entries(logfile, *args, **kwargs):
+        for count, dat_line in enumerate(iter_file_entries(logfile, *args, **kwargs)):
+            if logfile == interrupted_logfile and count == after:
+                raise KeyboardInterrupt
+            yield dat_line
+    return iter_entries
+
+
+class DATExportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.test_path = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_path, "dat.db")
+        self.logfiles = []
+        for number in range(2):
+            logfile = os.path.join(self.test_path, f"drive_access_tracker.{number}.log")
+            generate_dat_file(logfile, FILE_LINES, pid=1000 + number, seed=number)
+            self.logfiles.append(logfile)
+        self.file_lines = [sum(1 for _ in iter_file_entries(logfile)) for logfile in self.logfiles]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def export(self) -> int:
+        with mock.patch("builtins.print"):
+            return dat_export.export_entries(self.logfiles, self.db_path)
+
+    def interrupted(self):
+        '''
+        Ctrl+C in the middle of the second file, small batches so part of it already went to sqlite.
+        '''
+        return mock.patch.multiple(dat_export, iter_file_entries=interrupted_entries(self.logfiles[1], FILE_LINES // 2),
+                                   DATExporter=functools.partial(dat_export.DATExporter, batch_size=100))
+
+    def count_rows(self):
+        connection = sqlite3.connect(self.db_path)
+        try:
+            files = connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            entries = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            cycles = connection.execute("SELECT COUNT(DISTINCT file_id) FROM cycles").fetchone()[0]
+        finally:
+            connection.close()
+        return files, entries, cycles
+
+    def test_interrupted_file_exported_again(self):
+        with self.interrupted():
+            with self.assertRaises(KeyboardInterrupt):
+                self.export()
+        self.assertEqual(self.count_rows(), (1, self.file_lines[0], 1))
+
+        self.assertEqual(self.export(), self.file_lines[1])
+        self.assertEqual(self.count_rows(), (2, sum(self.file_lines), 2))
+
+    def test_changed_file_kept_when_interrupted(self):
+        self.export()
+        with open(self.logfiles[1], "a") as f:
+            f.write("\n")
+        with self.interrupted():
+            with self.assertRaises(KeyboardInterrupt):
+                self.export()
+        # Old rows of the changed file are still there, the next run replaces them
+        self.assertEqual(self.count_rows(), (2, sum(self.file_lines), 2))
+        self.assertEqual(self.export(), self.file_lines[1])
+        self.assertEqual(self.count_rows(), (2, sum(self.file_lines), 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+'''
+Checks the in-process readers of gtax_except_fail_mount_with_link.py against
+the shell pipelines they replaced (tac | grep | cut, tail | head).
+Run with: python3 -m unittest test_gtax_readers
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import gtax_except_fail_mount_with_link as gtax
+
+
+HAS_SHELL_TOOLS = all(shutil.which(tool) for tool in ("tac", "grep", "cut", "tail", "head"))
+# results.log lines, with the section words where grep -w matches and where it does not
+RESULT_LINES = ["ABCD_0001 status check", "WXYZ_00A2 1 fail", "Fail:", "Ignore:", "Summary Fail: 3",
+                "NotFail: 2", "Fail:x", "abcd_0001 lower case", " ABCD_0002 indented", "", "Ignore: 2 rules",
+                "EFGH_1234", "Exception: timeout"]
+NUM_RANDOM_FILES = 300
+
+
+def getstatusoutput(command: str):
+    '''
+    subprocess.getstatusoutput() without stderr, newer grep warns about the "\\_" of RULE_ID_REGEX.
+    '''
+    process = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout
+    return process.returncode, output[:-1] if output.endswith("\n") else output
+
+def shell_fail_test_ids(results_path: str):
+    '''
+    get_fail_test_ids() before it read results.log in-process: (return value, failed rule ids).
+    '''
+    fail_line_err, fail_line = getstatusoutput(f'tac {results_path} | grep -wnm 1 Fail: | cut -d":" -f 1')
+    if fail_line_err != 0 or fail_line == '':
+        return None, []
+    ignore_line_err, ignore_line = getstatusoutput(f'tac {results_path} | grep -wnm 1 Ignore: | cut -d":" -f 1')
+    if ignore_line_err == 0 and ignore_line != '':
+        ignore_line = int(fail_line) - int(ignore_line)
+        stringa = f'tail -n {fail_line} {results_path} | head -n {ignore_line}'
+    else:
+        stringa = f'tail -n {fail_line} {results_path}'
+    failed_rule_ids_err, failed_rule_ids = getstatusoutput(f"{stringa} | grep -Eo '{gtax.RULE_ID_REGEX}'")
+    if failed_rule_ids_err == 0 and failed_rule_ids != '':
+        return True, failed_rule_ids.split("\n")
+    return False, []
+
+def shell_file_tail(exceptions_path: str) -> str:
+    return getstatusoutput(f'tail -n 4 {exceptions_path}')[1].strip()
+
+
+class GTAXReadersTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.test_path = tempfile.mkdtemp()
+        self.results_path = os.path.join(self.test_path, gtax.RESULTS_FILE_NAME)
+        self.exceptions_path = os.path.join(self.test_path, gtax.EXCEPTIONS_FILE_NAME)
+        self.rng = random.Random(0)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def random_text(self, trailing_newline: bool = True) -> str:
+        lines = [self.rng.choice(RESULT_LINES) for _ in range(self.rng.randint(0, 40))]
+        text = "\n".join(lines)
+        if lines and trailing_newline:
+            text += "\n"
+        return text
+
+    def write(self, path: str, text: str) -> None:
+        with open(path, "w") as f:
+            f.write(text)
+
+    def fail_test_ids(self):
+        test = gtax.TestwFile("1", "1")
+        test.test_path = self.test_path
+        return test.get_fail_test_ids(), test.failed_rule_ids
+
+    def file_tail(self):
+        test = gtax.TestwFile("1", "1")
+        test.test_path = self.test_path
+        test.get_file_tail()
+        return test.file_tail
+
+    def test_read_lines_backward(self):
+        for _ in range(NUM_RANDOM_FILES):
+            text = self.random_text(trailing_newline=self.rng.random() < 0.5)
+            self.write(self.results_path, text)
+            lines = text.split("\n")
+            if text.endswith("\n") or not text:
+                lines.pop()
+            for block_size in (1, 3, 16, 64 * 1024):
+                self.assertEqual(list(gtax.read_lines_backward(self.results_path, block_size)), lines[::-1])
+
+    @unittest.skipUnless(HAS_SHELL_TOOLS, "needs tac, grep, cut, tail and head")
+    def test_fail_test_ids_match_pipeline(self):
+        for _ in range(NUM_RANDOM_FILES):
+            self.write(self.results_path, self.random_text())
+            self.assertEqual(self.fail_test_ids(), shell_fail_test_ids(self.results_path))
+
+    @unittest.skipUnless(HAS_SHELL_TOOLS, "needs tac, grep, cut, tail and head")
+    def test_fail_test_ids_without_trailing_newline(self):
+        '''
+        tac glues an unterminated last line to the one before it, the reader
+        keeps it as its own line: same result as the pipeline once the
+        newline is added.
+        '''
+        for _ in range(NUM_RANDOM_FILES):
+            text = self.random_text(trailing_newline=False)
+            if text.endswith("\n"):
+                # Last line was empty, the file ends with a newline anyway
+                continue
+            self.write(self.results_path, text + "\n")
+            expected = shell_fail_test_ids(self.results_path)
+            self.write(self.results_path, text)
+            self.assertEqual(self.fail_test_ids(), expected)
+
+    def test_fail_test_ids_unterminated_ignore_line(self):
+        # tac gives "WXYZ_0002Ignore:", where grep -w no longer sees the Ignore: line
+        self.write(self.results_path, "Fail:\nABCD_0001 x\nIgnore:\nWXYZ_0002")
+        self.assertEqual(self.fail_test_ids(), (True, ["ABCD_0001"]))
+
+    def test_fail_test_ids_missing_file(self):
+        self.assertEqual(self.fail_test_ids(), (None, []))
+
+    @unittest.skipUnless(HAS_SHELL_TOOLS, "needs tac, grep, cut, tail and head")
+    def test_file_tail_matches_tail(self):
+        for _ in range(NUM_RANDOM_FILES):
+            self.write(self.exceptions_path, self.random_text(trailing_newline=self.rng.random() < 0.5))
+            self.assertEqual(self.file_tail(), shell_file_tail(self.exceptions_path))
+
+
+if __name__ == '__main__':
+    unittest.main()